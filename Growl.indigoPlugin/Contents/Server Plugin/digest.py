@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Digests - notifications of a type that are held and sent together as one.
+#
+# Each notification type can be delivered immediately, in a digest every few
+# minutes, or in a digest only during quiet hours. Held notifications are kept
+# as compact NotificationRecords, and only the most recent ones of each type are
+# kept so a busy type can't use up memory; the digest says how many more there
+# were.
+
+import collections
+import threading
+import time
+
+# most notifications of one type kept for its digest
+kDigestSize = 20
+
+################################################################################
+class Digest(object):
+    # Notifications of one type waiting to be sent
+    def __init__(self, size):
+        # (time held, NotificationRecord), oldest first
+        self.records = collections.deque(maxlen=size)
+        self.dropped = 0
+        self.since = time.time()
+
+    def add(self, record):
+        if len(self.records) == self.records.maxlen:
+            self.dropped += 1
+        self.records.append((time.time(), record))
+
+    def combine(self, typeString):
+        # The keyword arguments for GrowlNotifier.notify() of one notification standing in for all of them
+        total = len(self.records) + self.dropped
+        if total == 1:
+            # nothing to combine it with, so it's sent as it was
+            held, record = self.records[0]
+            return {"noteType": typeString, "title": record.title, "description": record.text or u"",
+                    "priority": record.priority or 0, "sticky": record.sticky}
+        lines = []
+        if self.dropped > 0:
+            lines.append(u"...and %d earlier" % self.dropped)
+        for held, record in self.records:
+            line = u"%s %s" % (time.strftime("%H:%M", time.localtime(held)), record.title)
+            if record.text:
+                line += u" - " + record.text
+            lines.append(line)
+        return {"noteType": typeString,
+                "title": u"%d %s" % (total, typeString),
+                "description": u"\n".join(lines),
+                "priority": max(record.priority or 0 for held, record in self.records),
+                "sticky": any(record.sticky for held, record in self.records)}
+
+################################################################################
+class DigestBuffer(object):
+    ########################################
+    def __init__(self, size=kDigestSize):
+        self.size = size
+        # type key -> Digest
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def add(self, typeKey, record):
+        with self._lock:
+            digest = self._digests.get(typeKey)
+            if digest is None:
+                digest = self._digests[typeKey] = Digest(self.size)
+            digest.add(record)
+
+    def pending(self):
+        # [(type key, when its first notification was held)]
+        with self._lock:
+            return [(typeKey, digest.since) for typeKey, digest in self._digests.iteritems()]
+
+    def take(self, typeKey):
+        # Removes and returns the Digest for a type, None if there isn't one
+        with self._lock:
+            return self._digests.pop(typeKey, None)
+
+################################################################################
+def inQuietHours(start, end, now=None):
+    # start and end are "HH:MM" - quiet hours may run past midnight
+    if now is None:
+        now = time.localtime()
+    minute = now.tm_hour * 60 + now.tm_min
+    start = minuteOfDay(start)
+    end = minuteOfDay(end)
+    if start <= end:
+        return start <= minute < end
+    return minute >= start or minute < end
+
+def minuteOfDay(value):
+    # "HH:MM" -> minutes since midnight, ValueError if it isn't a time
+    hours, minutes = value.strip().split(":")
+    hours = int(hours)
+    minutes = int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(value)
+    return hours * 60 + minutes
@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Aggregated reporting of failed sends.
+#
+# When a Growl host goes away every notification fails the same way, and
+# logging each one floods the Indigo event log. Failures are counted per host
+# and kind of error instead: the first one is logged straight away, then a
+# summary with the count is logged once per window while they keep coming,
+# and a single message is logged when sending to the host works again.
+
+import errno
+import os
+import socket
+import threading
+import time
+
+# hints for the errors people can do something about
+kHints = {errno.ECONNREFUSED: u"make sure the Growl application is running",
+          errno.EHOSTUNREACH: u"make sure the Mac is on and connected to the network",
+          errno.ENETUNREACH: u"make sure the Mac is on and connected to the network"}
+
+################################################################################
+def classify(error):
+    # Short description of what went wrong, the same for every failure of the same kind.
+    # error is an exception or the (code, description) GNTP error a host answered with.
+    if isinstance(error, tuple):
+        return u"Growl rejected it (%s)" % error[-1]
+    if isinstance(error, socket.timeout):
+        return u"timed out"
+    if isinstance(error, socket.gaierror):
+        return u"the host name couldn't be looked up"
+    if isinstance(error, socket.error) and error.errno:
+        return os.strerror(error.errno).lower().decode("utf-8", "replace")
+    # anything else is described by its message, which is expected not to vary between failures
+    return unicode(error).split(u"\n")[0] or error.__class__.__name__
+
+def hint(error):
+    if isinstance(error, socket.error) and not isinstance(error, socket.gaierror):
+        return kHints.get(error.errno)
+    return None
+
+################################################################################
+class _Failures(object):
+    # Failures of one kind to one host
+    def __init__(self, now, count):
+        self.first = now
+        self.reported = now
+        self.total = count
+        # failures since the last time they were logged - the first ones are logged as they happen
+        self.pending = 0
+
+################################################################################
+class FailureReporter(object):
+    ########################################
+    def __init__(self, window, error, recovered):
+        # window is the seconds between summaries, error and recovered are called with the message to log
+        self.window = window
+        self.error = error
+        self.recovered = recovered
+        # (host, kind) -> _Failures
+        self._failures = {}
+        self._lock = threading.Lock()
+
+    ########################################
+    def failed(self, host, error, count=1):
+        # count is how many notifications failed together, like a batch that couldn't be sent at all
+        kind = classify(error)
+        now = time.time()
+        with self._lock:
+            failures = self._failures.get((host, kind))
+            if failures is not None:
+                failures.total += count
+                failures.pending += count
+                return
+            self._failures[(host, kind)] = _Failures(now, count)
+        message = u"Unable to send Growl Notification to %s - %s" % (host, kind)
+        if hint(error) is not None:
+            message += u" - " + hint(error)
+        if unicode(error) != kind:
+            message += u"\n" + unicode(error)
+        self.error(message)
+
+    def succeeded(self, host):
+        if len(self._failures) == 0:
+            # nothing has failed, which is nearly always the case
+            return
+        with self._lock:
+            ended = [(kind, failures) for (failedHost, kind), failures in self._failures.items() if failedHost == host]
+            for kind, failures in ended:
+                del self._failures[(host, kind)]
+        if len(ended) == 0:
+            return
+        total = sum(failures.total for kind, failures in ended)
+        minutes = (time.time() - min(failures.first for kind, failures in ended)) / 60.0
+        self.recovered(u"Growl notifications to %s are being delivered again (%d failed in %s)" % (host, total, _minutes(minutes)))
+
+    ########################################
+    def report(self):
+        # Logs a summary of everything that failed since the last one, once per window.
+        # Call it regularly - it does nothing until a window has passed.
+        now = time.time()
+        summaries = []
+        with self._lock:
+            for (host, kind), failures in self._failures.iteritems():
+                if failures.pending == 0 or now - failures.reported < self.window:
+                    continue
+                summaries.append((host, kind, failures.pending, (now - failures.reported) / 60.0))
+                failures.pending = 0
+                failures.reported = now
+        for host, kind, count, minutes in sorted(summaries):
+            self.error(u"%d more Growl Notifications to %s failed with \"%s\" in the last %s" % (count, host, kind, _minutes(minutes)))
+
+def _minutes(minutes):
+    if minutes < 1.5:
+        return u"1 minute"
+    return u"%d minutes" % round(minutes)
@@ -128,7 +128,6 @@ class _GNTPBase(object):
 		Validate GNTP Message against stored password
 		'''
 		self.password = password
-		if password == None: raise Exception()
 		keyHash = self.info.get('keyHash',None)
 		if keyHash is None and self.password is None:
 			return True
@@ -381,17 +380,31 @@ class GNTPNotice(_GNTPBase):
 
 class GNTPSubscribe(_GNTPBase):
 	"""Represents a GNTP Subscribe Command"""
+	_requiredHeaders = [
+		'Subscriber-ID',
+		'Subscriber-Name',
+	]
 	def __init__(self,data=None,password=None):
-		self.info['messagetype'] = 'SUBSCRIBE'
-		self._requiredHeaders = [
-			'Subscriber-ID',
-			'Subscriber-Name',
-		]
+		'''
+		@param data: (Optional) See decode()
+		@param password: (Optional) Password to use while encoding/decoding messages
+		'''
+		_GNTPBase.__init__(self, 'SUBSCRIBE')
 		if data:
 			self.decode(data,password)
 		else:
 			self.set_password(password)
 			self.add_origin_info()
+	def decode(self,data,password):
+		'''
+		Decode existing GNTP Subscribe message
+		@param data: Message to decode.
+		'''
+		self.raw = data
+		parts = self.raw.split('\r\n\r\n')
+		self.info = self._parse_info(data)
+		self._validate_password(password)
+		self.headers = self._parse_dict(parts[0])
 
 class GNTPOK(_GNTPBase):
 	"""Represents a GNTP OK Response"""
@@ -447,3 +460,24 @@ def parse_gntp(data,password=None):
 	elif info['messagetype'] == '-ERROR':
 		return GNTPError(data)
 	raise ParseError('INVALID_GNTP_MESSAGE')
+
+def read_message(sock):
+	'''
+	Read one complete GNTP message from a socket
+	@param sock: Connected socket
+	@return: Message or None if the connection closed first
+	'''
+	data = ''
+	while True:
+		blocks = data.split('\r\n\r\n')
+		if len(blocks) > 1:
+			if not data.upper().startswith('GNTP/1.0 REGISTER'):
+				return data
+			#Registrations have a block of headers for each notification
+			headers = dict(line.split(':', 1) for line in blocks[0].split('\r\n')[1:] if ':' in line)
+			if len(blocks) > int(headers.get('Notifications-Count', '0').strip() or 0) + 1:
+				return data
+		chunk = sock.recv(4096)
+		if not chunk:
+			return None
+		data += chunk
@@ -0,0 +1,100 @@
+"""
+Record outgoing GNTP traffic to a capture file and read it back
+
+A capture file is a gzip stream that starts with a short header followed
+by one record per message sent. Each record holds the time the message was
+sent (relative to the start of the capture), how long the round trip took,
+the message type and the encoded message itself.
+
+Set :attr:`gntp.notifier.GrowlNotifier.recorder` to a :class:`CaptureWriter`
+to start recording and use :mod:`gntp.replay` to play a capture back.
+"""
+import gzip
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = 'GNTPCAP\x01'
+
+# start time of the capture
+_header = struct.Struct('!d')
+# offset from start (usec), round trip (usec), message type, message length
+_record = struct.Struct('!QIBI')
+
+MESSAGE_TYPES = ['register', 'notify', 'subscribe']
+
+
+class CaptureWriter(object):
+	"""Append GNTP messages to a capture file
+
+	Safe to share between threads. Each record is flushed as it's written
+	so a capture is readable up to the last message even if it was never
+	closed.
+
+	:param string path: File to write, replaced if it exists
+	"""
+	def __init__(self, path):
+		self.path = path
+		self.count = 0
+		self._lock = threading.Lock()
+		self._file = gzip.GzipFile(path, 'wb')
+		self._start = time.time()
+		self._file.write(MAGIC + _header.pack(self._start))
+		self._file.flush(zlib.Z_SYNC_FLUSH)
+
+	def record(self, type, data, sent, elapsed):
+		'''
+		Write one message to the capture
+		@param type: Message type as passed to GrowlNotifier._send
+		@param data: Encoded message
+		@param sent: time.time() when the message was sent
+		@param elapsed: Seconds until the response arrived
+		'''
+		if isinstance(data, unicode):
+			data = data.encode('utf8', 'replace')
+		offset = max(0, int((sent - self._start) * 1000000))
+		elapsed = min(0xffffffff, max(0, int(elapsed * 1000000)))
+		with self._lock:
+			if self._file is None:
+				return
+			self._file.write(_record.pack(offset, elapsed, MESSAGE_TYPES.index(type), len(data)))
+			self._file.write(data)
+			self._file.flush(zlib.Z_SYNC_FLUSH)
+			self.count += 1
+
+	def close(self):
+		with self._lock:
+			if self._file is not None:
+				self._file.close()
+				self._file = None
+
+
+def read_capture(path):
+	'''
+	Read every message from a capture file
+	@param path: Capture file written by CaptureWriter
+	@return: List of (offset, elapsed, type, data) tuples, times in seconds
+	'''
+	messages = []
+	f = gzip.GzipFile(path, 'rb')
+	try:
+		if f.read(len(MAGIC)) != MAGIC:
+			raise ValueError('%s is not a GNTP capture' % path)
+		f.read(_header.size)
+		while True:
+			try:
+				header = f.read(_record.size)
+				if len(header) < _record.size:
+					break
+				offset, elapsed, type, length = _record.unpack(header)
+				data = f.read(length)
+			except (IOError, EOFError, zlib.error, struct.error):
+				# The capture was never closed, everything before this point is good
+				break
+			if len(data) < length:
+				break
+			messages.append((offset / 1000000.0, elapsed / 1000000.0, MESSAGE_TYPES[type], data))
+	finally:
+		f.close()
+	return messages
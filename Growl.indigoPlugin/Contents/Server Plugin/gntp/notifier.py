@@ -10,8 +10,13 @@ using GNTP
 
 """
 import gntp
+import gntp.records
+import gntp.transport
 import socket
 import logging
+import threading
+import time
+import Queue
 
 logger = logging.getLogger(__name__)
 
@@ -55,13 +60,16 @@ class GrowlNotifier(object):
 	:param string applicationIcon: Icon URL
 	:param string hostname: Remote host
 	:param integer port: Remote port
+	:param float timeout: Seconds to wait for the server before giving up, None waits forever
 	"""
 
 	passwordHash = 'MD5'
+	#: Optional :class:`gntp.capture.CaptureWriter` that every sent message is recorded to
+	recorder = None
 
 	def __init__(self, applicationName='Python GNTP', notifications=[],
 			defaultNotifications=None, applicationIcon=None, hostname='localhost',
-			password=None, port=23053):
+			password=None, port=23053, timeout=None):
 
 		self.applicationName = applicationName
 		self.notifications = list(notifications)
@@ -74,6 +82,7 @@ class GrowlNotifier(object):
 		self.password = password
 		self.hostname = hostname
 		self.port = int(port)
+		self.timeout = timeout
 
 	def _checkIcon(self, data):
 		'''
@@ -117,22 +126,77 @@ class GrowlNotifier(object):
 		:param integer priority: Message priority level from -2 to 2
 		"""
 		logger.info('Sending notification [%s] to %s:%s', noteType, self.hostname, self.port)
+		return self._send('notify', self._encode_notice(noteType, title, description, icon, sticky, priority))
+
+	def notify_many(self, notifications, parallelism=4):
+		"""Send a batch of GNTP notifications concurrently
+
+		Every notification is encoded before anything is sent, then up to
+		`parallelism` of them are delivered at the same time so the whole
+		batch takes roughly one round trip instead of one per notification.
+
+		.. warning::
+			Must have registered with growl beforehand or messages will be ignored
+
+		:param list notifications: Dictionaries of keyword arguments accepted by notify()
+		:param integer parallelism: Maximum number of notifications in flight at once
+		:return: List with one result per notification, in the same order. Each
+			result is True, the error tuple returned by the server or the
+			exception raised while encoding or sending that notification
+		"""
+		logger.info('Sending %d notifications to %s:%s', len(notifications), self.hostname, self.port)
+		results = [None] * len(notifications)
+		messages = [None] * len(notifications)
+		pending = Queue.Queue()
+		for index, notification in enumerate(notifications):
+			try:
+				messages[index] = self._encode_notice(**notification)
+			except Exception as e:
+				results[index] = e
+				continue
+			pending.put(index)
+
+		def worker():
+			while True:
+				try:
+					index = pending.get_nowait()
+				except Queue.Empty:
+					return
+				try:
+					results[index] = self._send('notify', messages[index])
+				except Exception as e:
+					results[index] = e
+
+		workers = []
+		for i in range(max(1, min(int(parallelism), pending.qsize()))):
+			thread = threading.Thread(target=worker, name='gntp-notify-%d' % i)
+			thread.daemon = True
+			thread.start()
+			workers.append(thread)
+		for thread in workers:
+			thread.join()
+		return results
+
+	def record(self, noteType, title, description, icon=None, sticky=False, priority=None):
+		"""Build a compact notification to be sent later with :meth:`send_record`
+
+		Takes the same parameters as :meth:`notify`
+
+		:return: :class:`gntp.records.NotificationRecord`
+		"""
 		assert noteType in self.notifications
-		notice = gntp.GNTPNotice()
-		notice.add_header('Application-Name', self.applicationName)
-		notice.add_header('Notification-Name', noteType)
-		notice.add_header('Notification-Title', title)
-		if self.password:
-			notice.set_password(self.password, self.passwordHash)
-		if sticky:
-			notice.add_header('Notification-Sticky', sticky)
-		if priority:
-			notice.add_header('Notification-Priority', priority)
-		if icon:
-			notice.add_header('Notification-Icon', self._checkIcon(icon))
-		if description:
-			notice.add_header('Notification-Text', description)
-		return self._send('notify', notice.encode())
+		application = gntp.records.ApplicationHeaders.get(self.applicationName, self.password, self.passwordHash)
+		return gntp.records.NotificationRecord(application, noteType, title, description,
+			self._checkIcon(icon) if icon else None, sticky, priority)
+
+	def send_record(self, record):
+		"""Send a notification built by :meth:`record`"""
+		logger.info('Sending notification [%s] to %s:%s', record.name, self.hostname, self.port)
+		return self._send('notify', record.encode())
+
+	def _encode_notice(self, noteType, title, description, icon=None, sticky=False, priority=None):
+		"""Build and encode a GNTP notification without sending it"""
+		return self.record(noteType, title, description, icon, sticky, priority).encode()
 
 	def subscribe(self, id, name, port):
 		"""Send a Subscribe request to a remote machine"""
@@ -144,15 +208,23 @@ class GrowlNotifier(object):
 			sub.set_password(self.password, self.passwordHash)
 		return self._send('subscribe', sub.encode())
 
-	def _send(self, type, data):
-		"""Send the GNTP Packet"""
+	def _send(self, type, data, attempt=None):
+		"""Send the GNTP Packet
+
+		:param attempt: Optional :class:`_Attempt` that can cancel the send from another thread
+		"""
 		logger.debug('To : %s:%s <%s>\n%s', self.hostname, self.port, type, data)
 
-		s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		s.connect((self.hostname, self.port))
-		s.send(data.encode('utf8', 'replace'))
-		response = gntp.parse_gntp(s.recv(1024))
-		s.close()
+		sent = time.time()
+		try:
+			if isinstance(data, unicode):
+				data = data.encode('utf8', 'replace')
+			transport = gntp.transport.HostTransport.get(self.hostname, self.port)
+			response = gntp.parse_gntp(transport.exchange(data, self.timeout, attempt))
+		finally:
+			recorder = self.recorder
+			if recorder is not None:
+				recorder.record(type, data, sent, time.time() - sent)
 
 		logger.debug('From : %s:%s <%s>\n%s', self.hostname, self.port, response.__class__, response)
 
@@ -161,6 +233,211 @@ class GrowlNotifier(object):
 		logger.error('Invalid response: %s', response.error())
 		return response.error()
 
+
+class LatencyTracker(object):
+	"""Exponentially weighted history of a host's response times
+
+	Works like the TCP retransmission timer: a smoothed latency and a
+	smoothed deviation are updated with every response and the hedging
+	budget is the latency plus four deviations.
+
+	:param float initial: Budget to use before any response has been seen
+	:param float minimum: Smallest budget ever returned
+	:param float maximum: Largest budget ever returned
+	"""
+	alpha = 0.125
+	beta = 0.25
+
+	def __init__(self, initial=0.5, minimum=0.05, maximum=1.0):
+		self.initial = initial
+		self.minimum = minimum
+		self.maximum = maximum
+		self.latency = None
+		self.deviation = None
+		self._lock = threading.Lock()
+
+	def update(self, elapsed):
+		'''
+		Add a response time to the history
+		@param elapsed: Seconds the host took to respond
+		'''
+		with self._lock:
+			if self.latency is None:
+				self.latency = elapsed
+				self.deviation = elapsed / 2
+			else:
+				self.deviation += self.beta * (abs(elapsed - self.latency) - self.deviation)
+				self.latency += self.alpha * (elapsed - self.latency)
+
+	def budget(self):
+		'''
+		How long to wait for the host before hedging to another one
+		@return: Seconds
+		'''
+		with self._lock:
+			if self.latency is None:
+				return self.initial
+			return min(self.maximum, max(self.minimum, self.latency + 4 * self.deviation))
+
+
+class _Attempt(object):
+	"""A send that can be cancelled from another thread"""
+	def __init__(self):
+		self.cancelled = False
+		self.finished = False
+		self._socket = None
+		self._lock = threading.Lock()
+
+	def bind(self, sock):
+		with self._lock:
+			if self.cancelled:
+				raise socket.error('Send was cancelled')
+			self._socket = sock
+
+	def finish(self):
+		'''
+		Let go of the socket once the exchange is over, so it can be reused
+		@return: False if the attempt was cancelled first and the socket may have been shut down
+		'''
+		with self._lock:
+			self.finished = True
+			self._socket = None
+			return not self.cancelled
+
+	def cancel(self):
+		with self._lock:
+			if self.finished:
+				# too late, the socket may already be sending something else
+				return
+			self.cancelled = True
+			if self._socket is not None:
+				try:
+					# wakes up a blocked connect or recv, close() alone doesn't
+					self._socket.shutdown(socket.SHUT_RDWR)
+				except socket.error:
+					pass
+
+
+class HedgedNotifier(object):
+	"""Send to a primary host and hedge to a backup host when it's slow
+
+	A notification goes to the primary host first. If no response arrives
+	within the primary's latency budget (see :class:`LatencyTracker`) or the
+	primary fails, the same notification is sent to the backup host. The
+	first success wins and any attempt still running is cancelled.
+
+	Latency history is kept per host for the life of the process so budgets
+	carry over between notifier instances.
+
+	:param primary: GrowlNotifier for the primary host
+	:param backup: GrowlNotifier for the backup host
+	"""
+	trackers = {}
+	_trackersLock = threading.Lock()
+
+	def __init__(self, primary, backup):
+		self.primary = primary
+		self.backup = backup
+
+	@classmethod
+	def tracker(cls, notifier):
+		'''
+		Latency history for the host a notifier sends to
+		@param notifier: GrowlNotifier
+		@return: LatencyTracker
+		'''
+		key = (notifier.hostname, notifier.port)
+		with cls._trackersLock:
+			if key not in cls.trackers:
+				cls.trackers[key] = LatencyTracker()
+			return cls.trackers[key]
+
+	def register(self):
+		"""Register with both hosts
+
+		:return: True if either host accepted the registration, otherwise the
+			primary host's error
+		"""
+		results = [None, None]
+
+		def run(index, notifier):
+			try:
+				results[index] = notifier.register()
+			except Exception as e:
+				results[index] = e
+
+		threads = [threading.Thread(target=run, args=(index, notifier))
+			for index, notifier in enumerate([self.primary, self.backup])]
+		for thread in threads:
+			thread.daemon = True
+			thread.start()
+		for thread in threads:
+			thread.join()
+		if True in results:
+			return True
+		if isinstance(results[0], Exception):
+			raise results[0]
+		return results[0]
+
+	def notify(self, noteType, title, description, icon=None, sticky=False, priority=None):
+		"""Send a GNTP notification to whichever host answers first
+
+		Takes the same parameters as :meth:`GrowlNotifier.notify`
+
+		:return: True if either host accepted the notification, otherwise the
+			primary host's error tuple
+		:raises: The primary host's exception if neither host accepted it
+		"""
+		logger.info('Sending hedged notification [%s] to %s:%s', noteType, self.primary.hostname, self.primary.port)
+		condition = threading.Condition()
+		outcomes = {}
+		attempts = {}
+
+		def run(notifier, attempt, data):
+			started = time.time()
+			try:
+				result = notifier._send('notify', data, attempt)
+			except Exception as e:
+				result = e
+			if attempt.cancelled:
+				# it would have taken at least this long, and a host that's always cancelled
+				# would otherwise never teach its tracker that it's slow
+				self.tracker(notifier).update(time.time() - started)
+				return
+			if result is True:
+				self.tracker(notifier).update(time.time() - started)
+			with condition:
+				outcomes[notifier] = result
+				condition.notify_all()
+
+		def start(notifier):
+			data = notifier._encode_notice(noteType, title, description, icon, sticky, priority)
+			attempts[notifier] = _Attempt()
+			thread = threading.Thread(target=run, args=(notifier, attempts[notifier], data))
+			thread.daemon = True
+			thread.start()
+
+		start(self.primary)
+		deadline = time.time() + self.tracker(self.primary).budget()
+		with condition:
+			while self.primary not in outcomes and time.time() < deadline:
+				condition.wait(deadline - time.time())
+			if outcomes.get(self.primary) is True:
+				return True
+			logger.info('Hedging notification [%s] to %s:%s', noteType, self.backup.hostname, self.backup.port)
+			start(self.backup)
+			while True not in outcomes.values() and len(outcomes) < 2:
+				condition.wait()
+			for notifier, attempt in attempts.items():
+				if notifier not in outcomes:
+					attempt.cancel()
+			if True in outcomes.values():
+				return True
+			result = outcomes[self.primary]
+		if isinstance(result, Exception):
+			raise result
+		return result
+
 if __name__ == '__main__':
 	mini('Testing mini notification')
 
@@ -0,0 +1,194 @@
+"""
+Compact notification records for holding many notifications in memory
+
+A :class:`gntp.GNTPNotice` carries its own info, headers and resources
+dictionaries plus a copy of every origin header, which adds up when
+thousands of notifications are queued. A :class:`NotificationRecord` only
+keeps the fields that differ between notifications in ``__slots__`` and
+points at an :class:`ApplicationHeaders` shared by every notification from
+the same application. Nothing is encoded until :meth:`NotificationRecord.encode`
+is called just before sending.
+
+Run this module to compare the memory used by each representation.
+"""
+import platform
+import sys
+import threading
+
+import gntp
+
+EOL = '\r\n'
+
+# header names are the same strings in every message
+APPLICATION_NAME = intern('Application-Name')
+NOTIFICATION_NAME = intern('Notification-Name')
+NOTIFICATION_TITLE = intern('Notification-Title')
+NOTIFICATION_TEXT = intern('Notification-Text')
+NOTIFICATION_ICON = intern('Notification-Icon')
+NOTIFICATION_STICKY = intern('Notification-Sticky')
+NOTIFICATION_PRIORITY = intern('Notification-Priority')
+
+_shared = {}
+_sharedLock = threading.Lock()
+
+
+def shared(value):
+	'''
+	Return a single shared copy of a string that many records hold, such as a
+	notification type name. Works for unicode, which intern() doesn't.
+	@param value: String
+	@return: Equal string, the same object for every equal value
+	'''
+	if value is None:
+		return None
+	with _sharedLock:
+		return _shared.setdefault(value, value)
+
+
+def _header(key, value):
+	if not isinstance(value, unicode):
+		value = unicode('%s' % value, 'utf8', 'replace')
+	return (u'%s: %s%s' % (key, value, EOL)).encode('utf8', 'replace')
+
+
+class ApplicationHeaders(object):
+	"""Headers that are the same for every notification an application sends
+
+	Use :meth:`get` rather than the constructor so equal applications share
+	one instance.
+
+	:param string applicationName: Sending application name
+	:param string password: Optional password
+	:param string passwordHash: Hash algorithm used with the password
+	"""
+	__slots__ = ('applicationName', 'password', 'passwordHash', 'headers')
+
+	_instances = {}
+	_instancesLock = threading.Lock()
+
+	def __init__(self, applicationName, password=None, passwordHash='MD5'):
+		self.applicationName = applicationName
+		self.password = password
+		self.passwordHash = passwordHash
+		self.headers = ''.join([
+			_header(APPLICATION_NAME, applicationName),
+			_header('Origin-Machine-Name', platform.node()),
+			_header('Origin-Software-Name', 'gntp.py'),
+			_header('Origin-Software-Version', gntp.__version__),
+			_header('Origin-Platform-Name', platform.system()),
+			_header('Origin-Platform-Version', platform.platform()),
+		])
+
+	@classmethod
+	def get(cls, applicationName, password=None, passwordHash='MD5'):
+		'''
+		Shared headers for an application
+		@return: ApplicationHeaders
+		'''
+		key = (applicationName, password, passwordHash)
+		with cls._instancesLock:
+			if key not in cls._instances:
+				cls._instances[key] = cls(applicationName, password, passwordHash)
+			return cls._instances[key]
+
+	def info(self):
+		'''
+		Info line for a NOTIFY message. A new salt is used for every message
+		when there's a password, so the line can't be shared.
+		@return: Encoded info line including the line ending
+		'''
+		if not self.password:
+			return 'GNTP/1.0 NOTIFY NONE' + EOL
+		message = gntp._GNTPBase('NOTIFY')
+		message.set_password(self.password, self.passwordHash)
+		return message._format_info().encode('utf8') + EOL
+
+
+class NotificationRecord(object):
+	"""Immutable notification waiting to be sent
+
+	:param application: ApplicationHeaders of the sending application
+	:param string name: Notification type name
+	:param string title: Notification title
+	:param string text: Optional notification text
+	:param string icon: Optional icon URL
+	:param boolean sticky: Sticky notification
+	:param integer priority: Optional priority level from -2 to 2
+	"""
+	__slots__ = ('application', 'name', 'title', 'text', 'icon', 'sticky', 'priority')
+
+	def __init__(self, application, name, title, text=None, icon=None, sticky=False, priority=None):
+		init = object.__setattr__
+		init(self, 'application', application)
+		init(self, 'name', shared(name))
+		init(self, 'title', title)
+		init(self, 'text', text or None)
+		init(self, 'icon', shared(icon) if icon else None)
+		init(self, 'sticky', bool(sticky))
+		init(self, 'priority', int(priority) if priority else None)
+
+	def __setattr__(self, name, value):
+		raise AttributeError('NotificationRecord is immutable')
+
+	def __delattr__(self, name):
+		raise AttributeError('NotificationRecord is immutable')
+
+	def __repr__(self):
+		return '<NotificationRecord [%s] %r>' % (self.name, self.title)
+
+	def encode(self):
+		'''
+		Encode as a GNTP NOTIFY message
+		@return: Message as UTF-8 bytes, ready to be sent
+		'''
+		if not self.name:
+			raise gntp.ParseError('Missing Notification Header: ' + NOTIFICATION_NAME)
+		if not self.title:
+			raise gntp.ParseError('Missing Notification Header: ' + NOTIFICATION_TITLE)
+		parts = [self.application.info(), self.application.headers,
+			_header(NOTIFICATION_NAME, self.name), _header(NOTIFICATION_TITLE, self.title)]
+		if self.sticky:
+			parts.append(_header(NOTIFICATION_STICKY, self.sticky))
+		if self.priority:
+			parts.append(_header(NOTIFICATION_PRIORITY, self.priority))
+		if self.icon:
+			parts.append(_header(NOTIFICATION_ICON, self.icon))
+		if self.text:
+			parts.append(_header(NOTIFICATION_TEXT, self.text))
+		parts.append(EOL)
+		return ''.join(parts)
+
+
+def _deep_size(obj, seen):
+	if id(obj) in seen:
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+	elif isinstance(obj, (list, tuple)):
+		size += sum(_deep_size(item, seen) for item in obj)
+	if hasattr(obj, '__dict__'):
+		size += _deep_size(obj.__dict__, seen)
+	for slot in getattr(type(obj), '__slots__', ()):
+		size += _deep_size(getattr(obj, slot, None), seen)
+	return size
+
+
+if __name__ == '__main__':
+	count = 10000
+	names = [u'Device Events', u'Motion Events', u'Security Events']
+	notices = []
+	for i in range(count):
+		notice = gntp.GNTPNotice(app=u'Indigo Plugin', name=names[i % 3], title=u'Front door %d' % i)
+		notice.add_header(NOTIFICATION_TEXT, u'The front door was opened')
+		notices.append(notice)
+	application = ApplicationHeaders.get(u'Indigo Plugin')
+	records = [NotificationRecord(application, names[i % 3], u'Front door %d' % i, u'The front door was opened')
+		for i in range(count)]
+	noticeSize = _deep_size(notices, set())
+	recordSize = _deep_size(records, set())
+	print('%d notifications' % count)
+	print('GNTPNotice:         %8d bytes, %d per notification' % (noticeSize, noticeSize / count))
+	print('NotificationRecord: %8d bytes, %d per notification' % (recordSize, recordSize / count))
+	print('%.1fx smaller' % (float(noticeSize) / recordSize))
@@ -0,0 +1,297 @@
+"""
+Play GNTP traffic against a server and report how quickly it was handled
+
+Traffic comes either from a capture recorded with :mod:`gntp.capture` or
+from a synthetic workload with a given rate and priority mix. Messages are
+sent on schedule by a pool of workers no matter how the server is keeping
+up, and latency is measured from the time a message was due to be sent so
+queueing delays show up in the results.
+
+Run from the folder that contains the gntp package::
+
+	# a local server that answers every message with -OK after 5ms
+	python -m gntp.replay listen --port 23053 --delay 0.005
+
+	# the same, closing the connection after every message
+	python -m gntp.replay listen --port 23053 --delay 0.005 --no-keep-alive
+
+	# play a capture back at twice the original speed
+	python -m gntp.replay capture traffic.gntpcap --speed 2
+
+	# 50 notifications a second, mostly normal priority with a few emergencies
+	python -m gntp.replay synthetic --rate 50 --count 1000 --priorities=0:9,2:1
+"""
+import argparse
+import math
+import random
+import SocketServer
+import sys
+import threading
+import time
+import Queue
+
+import gntp
+import gntp.transport
+import gntp.capture
+import gntp.notifier
+
+kDefaultTypes = ['Attention Events', 'Device Events', 'General Events', 'Motion Events',
+	'Security Events', 'Sprinkler Events', 'Variable Changes', 'Weather Events']
+
+
+class Report(object):
+	"""Results of one run"""
+	def __init__(self):
+		self.latencies = []
+		self.ok = 0
+		self.failed = 0
+		self.errors = {}
+		self.duration = 0.0
+		self.connects = 0
+
+	def add(self, latency, error=None):
+		self.latencies.append(latency)
+		if error is None:
+			self.ok += 1
+		else:
+			self.failed += 1
+			self.errors[error] = self.errors.get(error, 0) + 1
+
+	def percentile(self, p):
+		'''
+		Latency at the given percentile using the nearest-rank method
+		@param p: Percentile from 0 to 100
+		@return: Latency in seconds
+		'''
+		if not self.latencies:
+			return 0.0
+		ordered = sorted(self.latencies)
+		rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+		return ordered[max(0, min(rank, len(ordered) - 1))]
+
+	def __str__(self):
+		sent = self.ok + self.failed
+		lines = ['sent %d messages in %.2fs (%.1f/s) over %d connections, %d ok, %d failed' % (
+			sent, self.duration, sent / self.duration if self.duration else 0.0, self.connects, self.ok, self.failed)]
+		if self.latencies:
+			lines.append('latency ms: p50 %.2f  p99 %.2f  p999 %.2f  max %.2f' % (
+				self.percentile(50) * 1000, self.percentile(99) * 1000,
+				self.percentile(99.9) * 1000, max(self.latencies) * 1000))
+		for error, count in sorted(self.errors.items()):
+			lines.append('  %dx %s' % (count, error))
+		return '\n'.join(lines)
+
+
+class LoadGenerator(object):
+	"""Send a schedule of GNTP messages with a fixed number of workers
+
+	:param string hostname: Server to send to
+	:param integer port: Server port
+	:param integer concurrency: Maximum number of messages in flight
+	"""
+	def __init__(self, hostname='localhost', port=23053, concurrency=8):
+		self.notifier = gntp.notifier.GrowlNotifier(hostname=hostname, port=port)
+		self.concurrency = concurrency
+
+	def run(self, schedule, speed=1.0):
+		'''
+		Send every message in the schedule
+		@param schedule: List of (offset, type, data) tuples sorted by offset in seconds
+		@param speed: Playback speed multiplier, 0 sends everything as fast as possible
+		@return: Report
+		'''
+		report = Report()
+		lock = threading.Lock()
+		pending = Queue.Queue()
+		transport = gntp.transport.HostTransport.get(self.notifier.hostname, self.notifier.port)
+		connects = transport.connects
+
+		def worker():
+			while True:
+				item = pending.get()
+				if item is None:
+					return
+				due, type, data = item
+				error = None
+				try:
+					result = self.notifier._send(type, data)
+					if result is not True:
+						error = 'GNTP error %s' % (result,)
+				except Exception as e:
+					error = '%s: %s' % (e.__class__.__name__, e)
+				latency = time.time() - due
+				with lock:
+					report.add(latency, error)
+
+		workers = []
+		for i in range(self.concurrency):
+			thread = threading.Thread(target=worker, name='replay-%d' % i)
+			thread.daemon = True
+			thread.start()
+			workers.append(thread)
+
+		start = time.time()
+		for offset, type, data in schedule:
+			due = start + (offset / speed if speed else 0)
+			delay = due - time.time()
+			if delay > 0:
+				time.sleep(delay)
+			pending.put((due, type, data))
+		for thread in workers:
+			pending.put(None)
+		for thread in workers:
+			thread.join()
+		report.duration = time.time() - start
+		report.connects = transport.connects - connects
+		return report
+
+
+def capture_schedule(path):
+	'''
+	Build a schedule from a capture file
+	@param path: Capture file
+	@return: List of (offset, type, data) tuples
+	'''
+	return [(offset, type, data.decode('utf8', 'replace'))
+		for offset, elapsed, type, data in gntp.capture.read_capture(path)]
+
+
+def synthetic_schedule(notifier, rate, count, priorities, poisson=True, seed=None):
+	'''
+	Build a schedule of notifications arriving at an average rate
+	@param notifier: GrowlNotifier the messages are encoded for
+	@param rate: Average notifications per second
+	@param count: Number of notifications
+	@param priorities: List of (priority, weight) tuples
+	@param poisson: Exponential gaps between notifications instead of even spacing
+	@param seed: Random seed so a workload can be repeated
+	@return: List of (offset, type, data) tuples
+	'''
+	rng = random.Random(seed)
+	total = float(sum(weight for priority, weight in priorities))
+	schedule = []
+	offset = 0.0
+	for i in range(count):
+		pick = rng.random() * total
+		for priority, weight in priorities:
+			pick -= weight
+			if pick < 0:
+				break
+		noteType = notifier.notifications[i % len(notifier.notifications)]
+		data = notifier._encode_notice(noteType, 'Replay %d' % i, 'Synthetic notification', priority=priority)
+		schedule.append((offset, 'notify', data))
+		offset += rng.expovariate(rate) if poisson else 1.0 / rate
+	return schedule
+
+
+class _ListenerHandler(SocketServer.BaseRequestHandler):
+	def handle(self):
+		with self.server.lock:
+			self.server.connections += 1
+		while True:
+			message = gntp.read_message(self.request)
+			if message is None:
+				return
+			if self.server.delay:
+				time.sleep(self.server.delay)
+			info = message.split('\r\n', 1)[0].split(' ')
+			if len(info) > 1 and info[0].upper().startswith('GNTP/'):
+				response = gntp.GNTPOK(action=info[1].upper())
+			else:
+				response = gntp.GNTPError(errorcode=500, errordesc='Error parsing the message')
+			keepAlive = self.server.keepAlive and gntp.transport.keeps_alive(message)
+			if keepAlive:
+				response.add_header('Connection', 'Keep-Alive')
+			self.request.sendall(response.encode().encode('utf8'))
+			with self.server.lock:
+				self.server.count += 1
+			if not keepAlive:
+				return
+
+
+class Listener(SocketServer.ThreadingTCPServer):
+	"""Minimal GNTP server that answers every message with -OK
+
+	:param string hostname: Address to listen on
+	:param integer port: Port to listen on
+	:param float delay: Seconds to wait before answering each message
+	:param boolean keepAlive: Keep connections open for clients that ask
+	"""
+	allow_reuse_address = True
+	daemon_threads = True
+	# bursts open many connections at once, don't let the kernel drop them
+	request_queue_size = 128
+
+	def __init__(self, hostname='127.0.0.1', port=23053, delay=0.0, keepAlive=True):
+		SocketServer.ThreadingTCPServer.__init__(self, (hostname, port), _ListenerHandler)
+		self.delay = delay
+		self.keepAlive = keepAlive
+		self.count = 0
+		self.connections = 0
+		self.lock = threading.Lock()
+
+
+def _parse_priorities(value):
+	priorities = []
+	for item in value.split(','):
+		priority, weight = item.split(':')
+		priorities.append((int(priority), float(weight)))
+	return priorities
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog='gntp.replay', description=__doc__.strip().split('\n')[0])
+	commands = parser.add_subparsers(dest='command')
+
+	listen = commands.add_parser('listen', help='run a local GNTP server that answers -OK')
+	listen.add_argument('--host', default='127.0.0.1')
+	listen.add_argument('--port', type=int, default=23053)
+	listen.add_argument('--delay', type=float, default=0.0, help='seconds to wait before each answer')
+	listen.add_argument('--no-keep-alive', dest='keepAlive', action='store_false',
+		help='close every connection after one message')
+
+	for name, help in [('capture', 'play back a capture file'), ('synthetic', 'send a generated workload')]:
+		command = commands.add_parser(name, help=help)
+		command.add_argument('--host', default='localhost')
+		command.add_argument('--port', type=int, default=23053)
+		command.add_argument('--concurrency', type=int, default=8, help='messages in flight at once')
+	capture = commands.choices['capture']
+	capture.add_argument('path')
+	capture.add_argument('--speed', type=float, default=1.0, help='playback speed, 0 for as fast as possible')
+	synthetic = commands.choices['synthetic']
+	synthetic.add_argument('--rate', type=float, default=10.0, help='notifications per second')
+	synthetic.add_argument('--count', type=int, default=1000)
+	synthetic.add_argument('--priorities', type=_parse_priorities, default=[(0, 1.0)],
+		help='priority:weight pairs, e.g. -2:1,0:8,2:1')
+	synthetic.add_argument('--uniform', action='store_true', help='evenly spaced instead of Poisson arrivals')
+	synthetic.add_argument('--seed', type=int, default=None)
+
+	args = parser.parse_args(argv)
+	if args.command == 'listen':
+		server = Listener(args.host, args.port, args.delay, args.keepAlive)
+		print('Listening on %s:%d' % (args.host, args.port))
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			pass
+		print('Answered %d messages on %d connections' % (server.count, server.connections))
+		return 0
+
+	generator = LoadGenerator(args.host, args.port, args.concurrency)
+	if args.command == 'capture':
+		report = generator.run(capture_schedule(args.path), args.speed)
+	else:
+		notifier = gntp.notifier.GrowlNotifier(applicationName='gntp.replay', notifications=kDefaultTypes,
+			hostname=args.host, port=args.port)
+		result = notifier.register()
+		if result is not True:
+			print('Registration failed: %s' % (result,))
+			return 1
+		schedule = synthetic_schedule(notifier, args.rate, args.count, args.priorities,
+			poisson=not args.uniform, seed=args.seed)
+		report = generator.run(schedule)
+	print(report)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
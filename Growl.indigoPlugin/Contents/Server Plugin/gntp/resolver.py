@@ -0,0 +1,199 @@
+"""
+Cached host name resolution and dual-stack connects
+
+Looking up a host name can take as long as sending the notification, so
+:class:`AddressCache` keeps the addresses of every host for a while. Once
+they're older than the time to live they're still used while a background
+thread looks the name up again, so a notification never waits on the
+resolver after the first one. Names that can't be resolved are remembered
+too, for a shorter time, so an outage doesn't send every notification to a
+slow resolver.
+
+:func:`connect` races the addresses of a host the way RFC 8305 "Happy
+Eyeballs" describes: IPv6 and IPv4 addresses are tried alternately, each
+attempt starting a short time after the previous one unless that one has
+already failed, and the first connection made wins. The address that won
+last time is tried first.
+"""
+import errno
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+#: Seconds to wait for an attempt before starting the next, as RFC 8305 recommends
+CONNECTION_ATTEMPT_DELAY = 0.25
+
+
+class _Entry(object):
+	__slots__ = ('addresses', 'error', 'expires', 'winner', 'refreshing')
+
+	def __init__(self, addresses, error, expires):
+		self.addresses = addresses
+		self.error = error
+		self.expires = expires
+		self.winner = None
+		self.refreshing = False
+
+
+class AddressCache(object):
+	"""Addresses of the hosts notifications are sent to
+
+	:param integer ttl: Seconds addresses are used before they're looked up again
+	:param integer negativeTtl: Seconds a name that couldn't be resolved isn't looked up again
+	"""
+	def __init__(self, ttl=300, negativeTtl=30):
+		self.ttl = ttl
+		self.negativeTtl = negativeTtl
+		self._entries = {}
+		self._lock = threading.Lock()
+
+	def lookup(self, hostname, port):
+		'''
+		Addresses for a host, the one that connected last time first
+		@return: List of (family, sockaddr)
+		@raise socket.gaierror: The name couldn't be resolved
+		'''
+		key = (hostname, port)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry.addresses:
+				if entry.expires <= time.time() and not entry.refreshing:
+					entry.refreshing = True
+					thread = threading.Thread(target=self._refresh, args=(key,), name='gntp-resolve')
+					thread.daemon = True
+					thread.start()
+				return _order(entry.addresses, entry.winner)
+			if entry is not None and entry.expires > time.time():
+				raise entry.error
+		# nothing to go on yet, this one has to wait
+		entry = self._resolve(key)
+		if entry.error is not None:
+			raise entry.error
+		return _order(entry.addresses, None)
+
+	def won(self, hostname, port, address):
+		'''Remember the address that connected first so it's tried first next time'''
+		with self._lock:
+			entry = self._entries.get((hostname, port))
+			if entry is not None:
+				entry.winner = address
+
+	def expire(self, hostname, port):
+		'''
+		Look the host up again in the background the next time it's used,
+		for example after it couldn't be reached. The addresses are still
+		used until the new ones come back, and kept if the lookup fails.
+		'''
+		with self._lock:
+			entry = self._entries.get((hostname, port))
+			if entry is not None and entry.addresses:
+				entry.expires = 0
+
+	def _resolve(self, key):
+		hostname, port = key
+		try:
+			addresses = [(family, sockaddr) for family, type, proto, canonname, sockaddr
+				in socket.getaddrinfo(hostname, port, socket.AF_UNSPEC, socket.SOCK_STREAM)]
+			entry = _Entry(addresses, None, time.time() + self.ttl)
+		except socket.gaierror as e:
+			logger.info('Unable to resolve %s: %s', hostname, e)
+			entry = _Entry(None, e, time.time() + self.negativeTtl)
+		with self._lock:
+			previous = self._entries.get(key)
+			if entry.error is not None and previous is not None and previous.addresses:
+				# a resolver that's gone away isn't a reason to stop using addresses that worked
+				previous.expires = entry.expires
+				previous.refreshing = False
+				return previous
+			if previous is not None and previous.winner in (entry.addresses or ()):
+				entry.winner = previous.winner
+			self._entries[key] = entry
+		return entry
+
+	def _refresh(self, key):
+		self._resolve(key)
+
+
+def _order(addresses, winner):
+	'''Last winner first, then alternating address families starting with the first one's'''
+	addresses = list(addresses)
+	if winner in addresses:
+		addresses.remove(winner)
+		addresses.insert(0, winner)
+	if not addresses:
+		return addresses
+	first = [address for address in addresses if address[0] == addresses[0][0]]
+	other = [address for address in addresses if address[0] != addresses[0][0]]
+	ordered = []
+	for index in range(max(len(first), len(other))):
+		ordered.extend(first[index:index + 1])
+		ordered.extend(other[index:index + 1])
+	return ordered
+
+
+def connect(addresses, timeout=None, attempt=None, delay=CONNECTION_ATTEMPT_DELAY):
+	'''
+	Connect to whichever of the addresses answers first, starting a new
+	attempt every delay seconds until one connects
+	@param addresses: List of (family, sockaddr) in the order to try them
+	@param timeout: Seconds to wait in all, None to wait as long as the system does
+	@param attempt: Optional :class:`gntp.notifier._Attempt` that can cancel the connect from another thread
+	@return: (connected socket, (family, sockaddr) it connected to)
+	'''
+	remaining = list(addresses)
+	pending = {}
+	error = None
+	start = time.time()
+	nextStart = start
+	try:
+		while remaining or pending:
+			if attempt is not None and attempt.cancelled:
+				raise socket.error('Send was cancelled')
+			now = time.time()
+			if timeout is not None and now - start >= timeout:
+				raise socket.timeout('timed out')
+			if remaining and (now >= nextStart or not pending):
+				address = remaining.pop(0)
+				s = socket.socket(address[0], socket.SOCK_STREAM)
+				s.setblocking(False)
+				result = s.connect_ex(address[1])
+				if result in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+					pending[s] = address
+				else:
+					error = socket.error(result, os.strerror(result))
+					s.close()
+				nextStart = time.time() + delay
+				continue
+			# until the next attempt is due, the time is up, or it's time to see if it was cancelled
+			waits = []
+			if remaining:
+				waits.append(max(0, nextStart - now))
+			if timeout is not None:
+				waits.append(max(0, start + timeout - now))
+			if attempt is not None:
+				waits.append(0.1)
+			readable, writable, broken = select.select([], list(pending), [], min(waits) if waits else None)
+			for s in writable:
+				address = pending.pop(s)
+				result = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+				if result == 0:
+					s.setblocking(True)
+					return s, address
+				error = socket.error(result, os.strerror(result))
+				s.close()
+	finally:
+		# the attempts that lost, or all of them if none won
+		for s in pending:
+			s.close()
+	if error is None:
+		error = socket.error('No addresses to connect to')
+	raise error
+
+
+#: Cache shared by every notifier
+cache = AddressCache()
@@ -0,0 +1,181 @@
+"""
+Accept GNTP subscriptions and push notifications to every live subscriber
+
+A Growl client sends SUBSCRIBE to a :class:`SubscriptionServer` and is
+answered with the number of seconds the subscription lasts. Clients are
+expected to subscribe again before then; subscribers that don't are dropped
+from the :class:`SubscriberRegistry`. :func:`broadcast` sends to many
+subscribers at the same time, so the time it takes doesn't grow with the
+number of subscribers.
+"""
+import logging
+import socket
+import SocketServer
+import threading
+import time
+
+import gntp
+
+logger = logging.getLogger(__name__)
+
+#: Seconds a client has to send its whole SUBSCRIBE before the connection is dropped
+READ_TIMEOUT = 10.0
+
+
+class Subscriber(object):
+	"""A Growl client that has subscribed
+
+	:param string id: Subscriber-ID sent by the client, unique per client
+	:param string name: Subscriber-Name, usually the machine name
+	:param string hostname: Address the subscription came from
+	:param integer port: Port the client listens for notifications on
+	"""
+	__slots__ = ('id', 'name', 'hostname', 'port', 'expires', 'registered')
+
+	def __init__(self, id, name, hostname, port, expires):
+		self.id = id
+		self.name = name
+		self.hostname = hostname
+		self.port = port
+		self.expires = expires
+		#: Whatever the owner last registered with this subscriber, None if nothing yet
+		self.registered = None
+
+	def __repr__(self):
+		return '<Subscriber %s (%s) %s:%s>' % (self.name, self.id, self.hostname, self.port)
+
+
+class SubscriberRegistry(object):
+	"""Live subscribers, each expiring after a time to live
+
+	:param integer ttl: Seconds a subscription lasts unless it's renewed
+	"""
+	def __init__(self, ttl=300):
+		self.ttl = ttl
+		self._subscribers = {}
+		self._lock = threading.Lock()
+
+	def subscribe(self, id, name, hostname, port):
+		'''
+		Add a subscriber or renew its subscription
+		@return: (Subscriber, True if it wasn't already subscribed)
+		'''
+		expires = time.time() + self.ttl
+		with self._lock:
+			subscriber = self._subscribers.get(id)
+			if subscriber is not None and subscriber.expires > time.time() and \
+					(subscriber.hostname, subscriber.port) == (hostname, port):
+				subscriber.expires = expires
+				subscriber.name = name
+				return subscriber, False
+			subscriber = Subscriber(id, name, hostname, port, expires)
+			self._subscribers[id] = subscriber
+			return subscriber, True
+
+	def remove(self, id):
+		with self._lock:
+			self._subscribers.pop(id, None)
+
+	def live(self):
+		'''
+		Subscribers whose subscription hasn't expired. Expired ones are dropped.
+		@return: List of Subscriber
+		'''
+		now = time.time()
+		with self._lock:
+			for id in [id for id, subscriber in self._subscribers.items() if subscriber.expires <= now]:
+				logger.info('Subscription from %s expired', self._subscribers[id])
+				del self._subscribers[id]
+			return self._subscribers.values()
+
+
+class _SubscriptionHandler(SocketServer.BaseRequestHandler):
+	def handle(self):
+		# anyone on the network can connect, and one that never sends anything mustn't keep a thread forever
+		self.request.settimeout(READ_TIMEOUT)
+		try:
+			data = gntp.read_message(self.request)
+		except socket.timeout:
+			logger.warning('Nothing was received from %s, closing the connection', self.client_address[0])
+			return
+		except socket.error as e:
+			logger.warning('Unable to read from %s: %s', self.client_address[0], e)
+			return
+		if data is None:
+			return
+		subscriber = None
+		try:
+			message = gntp.parse_gntp(data, self.server.password)
+			if message.info['messagetype'] != 'SUBSCRIBE':
+				raise gntp.UnsupportedError('Only SUBSCRIBE is accepted')
+			message.validate()
+			port = int(message.headers.get('Subscriber-Port', 23053))
+			subscriber, new = self.server.registry.subscribe(message.headers['Subscriber-ID'],
+				message.headers['Subscriber-Name'], self.client_address[0], port)
+			response = gntp.GNTPOK(action='SUBSCRIBE')
+			response.add_header('Subscription-TTL', self.server.registry.ttl)
+			response = response.encode().encode('utf8')
+		except gntp.BaseError as e:
+			logger.warning('Rejected message from %s: %s', self.client_address[0], e)
+			response = e.gntp_error().encode('utf8')
+		except (ValueError, KeyError) as e:
+			logger.warning('Rejected message from %s: %s', self.client_address[0], e)
+			response = gntp.ParseError().gntp_error().encode('utf8')
+		self.request.sendall(response)
+		if subscriber is not None and self.server.onSubscribe is not None:
+			self.server.onSubscribe(subscriber, new)
+
+
+class SubscriptionServer(SocketServer.ThreadingTCPServer):
+	"""Listen for GNTP SUBSCRIBE requests
+
+	:param registry: SubscriberRegistry that subscriptions are added to
+	:param string hostname: Address to listen on, '' for all
+	:param integer port: Port to listen on
+	:param string password: Password subscribers must use, None for none
+	:param onSubscribe: Optional callable(subscriber, new) run after a subscription is accepted
+	"""
+	allow_reuse_address = True
+	daemon_threads = True
+
+	def __init__(self, registry, hostname='', port=23054, password=None, onSubscribe=None):
+		SocketServer.ThreadingTCPServer.__init__(self, (hostname, port), _SubscriptionHandler)
+		self.registry = registry
+		self.password = password
+		self.onSubscribe = onSubscribe
+
+	def start(self):
+		'''Serve on a background thread until shutdown() is called'''
+		thread = threading.Thread(target=self.serve_forever, name='gntp-subscriptions')
+		thread.daemon = True
+		thread.start()
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+
+def broadcast(targets, send):
+	'''
+	Call send(target) for every target at the same time, for example to push
+	a notification to each subscriber
+	@param targets: List of targets such as Subscriber
+	@param send: Callable that sends to one target
+	@return: List with one result per target, what send returned or the exception it raised
+	'''
+	results = [None] * len(targets)
+
+	def run(index, target):
+		try:
+			results[index] = send(target)
+		except Exception as e:
+			results[index] = e
+
+	threads = [threading.Thread(target=run, args=(index, target), name='gntp-broadcast-%d' % index)
+		for index, target in enumerate(targets)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
@@ -0,0 +1,186 @@
+"""
+Send GNTP messages over pooled connections
+
+Connecting is most of the cost of sending a notification to a nearby host,
+so each :class:`HostTransport` keeps a few connected sockets to its host
+and sends the next message over one of them. Messages ask the server to
+keep the connection open with a ``Connection: Keep-Alive`` header, and a
+socket is only kept when the answer carries the same header. Servers that
+don't answer with it get a new connection for every message, just like
+before. Every socket has Nagle's algorithm turned off, since a message is
+written in one go and waiting to fill a segment only adds delay.
+"""
+import errno
+import logging
+import socket
+import threading
+import time
+
+import gntp
+import gntp.resolver
+
+logger = logging.getLogger(__name__)
+
+KEEP_ALIVE = 'Connection: Keep-Alive'
+
+#: Seconds an idle connection is kept before it's closed rather than reused
+IDLE_TIMEOUT = 30.0
+
+
+def keeps_alive(message):
+	'''True if a message asks for the connection to be kept open'''
+	for line in message.split('\r\n\r\n', 1)[0].split('\r\n')[1:]:
+		key, _, value = line.partition(':')
+		if key.strip().lower() == 'connection':
+			return value.strip().lower() == 'keep-alive'
+	return False
+
+
+class HostTransport(object):
+	"""Connections to one GNTP server
+
+	Use :meth:`get` rather than the constructor so every notifier sending to
+	the same host shares the same connections.
+
+	:param string hostname: Server hostname
+	:param integer port: Server port
+	:param integer size: Most idle connections kept
+	"""
+	_instances = {}
+	_instancesLock = threading.Lock()
+
+	def __init__(self, hostname, port, size=4):
+		self.hostname = hostname
+		self.port = port
+		self.size = size
+		#: None until the server has answered, then whether it keeps connections open
+		self.keepAlive = None
+		#: Connections made, for measuring how often they're reused
+		self.connects = 0
+		self._idle = []
+		self._lock = threading.Lock()
+
+	@classmethod
+	def get(cls, hostname, port):
+		'''
+		Shared transport for a host
+		@return: HostTransport
+		'''
+		with cls._instancesLock:
+			if (hostname, port) not in cls._instances:
+				cls._instances[(hostname, port)] = cls(hostname, port)
+			return cls._instances[(hostname, port)]
+
+	def exchange(self, data, timeout=None, attempt=None):
+		'''
+		Send a message and read the answer
+		@param data: Encoded GNTP message
+		@param timeout: Socket timeout in seconds
+		@param attempt: Optional :class:`gntp.notifier._Attempt` that can cancel the exchange from another thread
+		@return: Encoded response
+		'''
+		if self.keepAlive is not False:
+			# right after the info line, where every message type has headers
+			info, _, rest = data.partition('\r\n')
+			data = '%s\r\n%s\r\n%s' % (info, KEEP_ALIVE, rest)
+		s, reused = self._acquire(timeout, attempt)
+		try:
+			response = self._send(s, data, reused)
+			if response is None and reused and not (attempt is not None and attempt.cancelled):
+				# the server closed the idle connection, which it may do at any time
+				logger.debug('Idle connection to %s:%s was closed, reconnecting', self.hostname, self.port)
+				s.close()
+				s = self._connect(timeout, attempt)
+				reused = False
+				response = self._send(s, data, reused)
+			if response is None:
+				raise socket.error('Connection closed by %s:%s before it answered' % (self.hostname, self.port))
+		except:
+			if attempt is not None:
+				attempt.finish()
+			s.close()
+			raise
+		keepAlive = keeps_alive(response)
+		if keepAlive != self.keepAlive:
+			logger.info('%s:%s %s connections open', self.hostname, self.port, 'keeps' if keepAlive else "doesn't keep")
+			self.keepAlive = keepAlive
+		# the attempt mustn't be able to shut the socket down once it's back in the pool
+		unbound = attempt is None or attempt.finish()
+		self._release(s, keepAlive and unbound)
+		return response
+
+	def _send(self, s, data, reused):
+		'''
+		@return: Response, or None if the connection was closed before it came
+		'''
+		try:
+			s.sendall(data)
+			return gntp.read_message(s)
+		except socket.timeout:
+			raise
+		except socket.error:
+			# a reset on a reused connection just means the server had closed it
+			if not reused:
+				raise
+			return None
+
+	def close(self):
+		'''Close every idle connection'''
+		with self._lock:
+			idle, self._idle = self._idle, []
+		for s, since in idle:
+			s.close()
+
+	def _acquire(self, timeout, attempt):
+		now = time.time()
+		s = None
+		with self._lock:
+			while self._idle:
+				s, since = self._idle.pop()
+				if now - since < IDLE_TIMEOUT:
+					break
+				s.close()
+				s = None
+		if s is None:
+			return self._connect(timeout, attempt), False
+		s.settimeout(timeout)
+		if attempt is not None:
+			try:
+				attempt.bind(s)
+			except socket.error:
+				self._release(s, True)
+				raise
+		return s, True
+
+	def _release(self, s, keep):
+		if keep:
+			with self._lock:
+				if len(self._idle) < self.size:
+					self._idle.append((s, time.time()))
+					return
+		s.close()
+
+	def _connect(self, timeout, attempt):
+		addresses = gntp.resolver.cache.lookup(self.hostname, self.port)
+		try:
+			s, address = gntp.resolver.connect(addresses, timeout, attempt)
+		except socket.timeout:
+			raise
+		except socket.error as e:
+			# A host that refused the connection is where the addresses say, Growl just isn't running.
+			# Otherwise it may have moved, so it's looked up again without waiting for the addresses to expire.
+			if e.errno != errno.ECONNREFUSED:
+				gntp.resolver.cache.expire(self.hostname, self.port)
+			raise
+		gntp.resolver.cache.won(self.hostname, self.port, address)
+		try:
+			s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			s.settimeout(timeout)
+			if attempt is not None:
+				attempt.bind(s)
+		except:
+			s.close()
+			raise
+		with self._lock:
+			self.connects += 1
+		return s
@@ -0,0 +1,152 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# History of recently sent notifications.
+#
+# A fixed number of entries is kept in a ring of arrays, one array per field,
+# so memory use doesn't grow and recording an entry is a handful of array
+# stores. The oldest entry is overwritten when the ring is full.
+#
+# Each entry has a sequence number. The sequence numbers of the entries of each
+# notification type and each outcome are kept in order in an index, so "the last
+# 10 Security Events" or "the failures today" only look at matching entries. An
+# entry that's overwritten is always the oldest one in its indexes, so removing
+# it from them is just as cheap.
+
+import array
+import collections
+import threading
+import time
+
+kOutcomes = ("sent", "failed")
+# titles are cut down to this so the history's memory use has a limit
+kMaxTitleLength = 100
+# most distinct types or targets a history can tell apart
+kMaxDistinct = 256
+
+################################################################################
+class Entry(object):
+    __slots__ = ("time", "typeKey", "priority", "target", "outcome", "latency", "title")
+
+    def __init__(self, time, typeKey, priority, target, outcome, latency, title):
+        self.time = time
+        self.typeKey = typeKey
+        self.priority = priority
+        self.target = target
+        self.outcome = outcome
+        self.latency = latency
+        self.title = title
+
+    def __repr__(self):
+        return "<Entry %s %s %r>" % (self.typeKey, self.outcome, self.title)
+
+################################################################################
+class History(object):
+    ########################################
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self._times = array.array("d", [0.0] * capacity)
+        self._types = array.array("B", [0] * capacity)
+        self._priorities = array.array("b", [0] * capacity)
+        self._targets = array.array("B", [0] * capacity)
+        self._outcomes = array.array("B", [0] * capacity)
+        self._latencies = array.array("f", [0.0] * capacity)
+        self._titles = [None] * capacity
+        # type keys and targets are stored as indexes into these
+        self._typeKeys = []
+        self._targetNames = []
+        # type index / outcome index -> sequence numbers, oldest first
+        self._byType = collections.defaultdict(collections.deque)
+        self._byOutcome = collections.defaultdict(collections.deque)
+        # sequence number of the next entry
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._next, self.capacity)
+
+    ########################################
+    def record(self, typeKey, priority, target, outcome, latency, title):
+        # typeKey is the pref key of the notification type, target the host it was sent to,
+        # outcome one of kOutcomes and latency in seconds
+        now = time.time()
+        if title is not None and len(title) > kMaxTitleLength:
+            title = title[:kMaxTitleLength]
+        outcomeIndex = kOutcomes.index(outcome)
+        with self._lock:
+            typeIndex = _lookup(self._typeKeys, typeKey)
+            targetIndex = _lookup(self._targetNames, target)
+            sequence = self._next
+            slot = sequence % self.capacity
+            if sequence >= self.capacity:
+                # the entry being overwritten is the oldest in both of its indexes
+                self._forget(self._byType, self._types[slot])
+                self._forget(self._byOutcome, self._outcomes[slot])
+            self._times[slot] = now
+            self._types[slot] = typeIndex
+            self._priorities[slot] = priority
+            self._targets[slot] = targetIndex
+            self._outcomes[slot] = outcomeIndex
+            self._latencies[slot] = latency
+            self._titles[slot] = title
+            self._byType[typeIndex].append(sequence)
+            self._byOutcome[outcomeIndex].append(sequence)
+            self._next = sequence + 1
+
+    def _forget(self, index, key):
+        sequences = index[key]
+        sequences.popleft()
+        if len(sequences) == 0:
+            del index[key]
+
+    ########################################
+    def query(self, typeKey=None, outcome=None, since=None, limit=None):
+        # Returns the matching entries, newest first. since is a time.time() value.
+        with self._lock:
+            candidates = []
+            if typeKey is not None:
+                if typeKey not in self._typeKeys:
+                    return []
+                candidates.append(self._byType.get(self._typeKeys.index(typeKey), ()))
+            if outcome is not None:
+                candidates.append(self._byOutcome.get(kOutcomes.index(outcome), ()))
+            if len(candidates) > 0:
+                # walk the smallest index and check the rest of the conditions on each entry
+                sequences = reversed(min(candidates, key=len))
+            else:
+                sequences = xrange(self._next - 1, self._next - len(self) - 1, -1)
+            entries = []
+            for sequence in sequences:
+                slot = sequence % self.capacity
+                if since is not None and self._times[slot] < since:
+                    # everything after this is older still
+                    break
+                entry = self._entry(slot)
+                if typeKey is not None and entry.typeKey != typeKey:
+                    continue
+                if outcome is not None and entry.outcome != outcome:
+                    continue
+                entries.append(entry)
+                if limit is not None and len(entries) >= limit:
+                    break
+            return entries
+
+    def _entry(self, slot):
+        return Entry(self._times[slot], self._typeKeys[self._types[slot]], self._priorities[slot],
+                     self._targetNames[self._targets[slot]], kOutcomes[self._outcomes[slot]],
+                     self._latencies[slot], self._titles[slot])
+
+################################################################################
+def _lookup(table, value):
+    # Index of value in a small table of distinct values, adding it if it's new. The indexes are
+    # stored in unsigned bytes, so once the table is full everything new shares the last index.
+    try:
+        return table.index(value)
+    except ValueError:
+        pass
+    if len(table) < kMaxDistinct - 1:
+        table.append(value)
+        return len(table) - 1
+    if len(table) < kMaxDistinct:
+        table.append(u"other")
+    return kMaxDistinct - 1
@@ -6,11 +6,25 @@
 
 ################################################################################
 # Python imports
+import hashlib
+import os
 import socket
+import threading
+import time
 
 # local imports
-import Growl.Growl as OldGrowl
 import gntp.notifier as NewGrowl
+import gntp
+import gntp.capture
+import gntp.records
+import gntp.subscription
+import digest
+import failures
+import history
+import profiling
+import rules
+import senders
+import submissions
 
 ################################################################################
 # Globals
@@ -18,6 +32,26 @@ import gntp.notifier as NewGrowl
 # the ID we're using to identify the plugin to the media server
 kApplicationName = "Indigo Plugin"
 kIconFileName = "application.icns"
+kIconURL = "http://static.indigodomo.com/www/images/growlicon_64x64.png"
+# seconds to wait for a Growl host to answer before giving up
+kGrowlTimeout = 10.0
+# where other Growl clients subscribe, and how long a subscription lasts before it must be renewed
+kSubscriptionPort = 23054
+kSubscriptionTTL = 300
+# how many notifications notifyMany sends at the same time unless the action says otherwise
+kDefaultParallelism = 4
+# how long to wait before probing a host again when no Growl was found on it
+kRedetectInterval = 60.0
+# how long a host is assumed to speak the Growl v1.2 protocol before it's probed again
+kLegacyRedetectInterval = 300.0
+# minutes between summaries of failed notifications to a host, unless the prefs say otherwise
+kErrorSummaryMinutes = 5
+# how many recently sent notifications are kept for the notification history
+kHistorySize = 1000
+# how often digests are sent, and when quiet hours are, unless the prefs say otherwise
+kDigestMinutes = 15
+kQuietStart = "22:00"
+kQuietEnd = "07:00"
 
 ################################################################################
 class Plugin(indigo.PluginBase):
@@ -25,8 +59,69 @@ class Plugin(indigo.PluginBase):
     def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
         if "growlVersion" not in self.pluginPrefs:
-            self.pluginPrefs["growlVersion"] = "1.3"
+            self.pluginPrefs["growlVersion"] = "auto"
+        if "hedgedTypes" not in self.pluginPrefs:
+            # Attention Events and Security Events
+            self.pluginPrefs["hedgedTypes"] = ["notification1", "notification5"]
         self.debug = False
+        # what Growl was last told about, so closing the prefs dialog only re-registers when it changed
+        try:
+            self._registeredSnapshot = self._notificationSnapshot()
+        except KeyError:
+            # the prefs dialog has never been saved
+            self._registeredSnapshot = None
+        # "primary" and "backup" -> the sender for that host's protocol, kept until a send to it fails
+        self._senders = {}
+        # role -> when no Growl was found there, so an unreachable host isn't probed on every notification
+        self._undetected = {}
+        # bumped whenever the senders are thrown away, so a probe that was running then doesn't put one back
+        self._sendersGeneration = 0
+        self._sendersLock = threading.Lock()
+        self._failures = failures.FailureReporter(self._errorSummaryWindow(), self.errorLog, indigo.server.log)
+        self._history = history.History(kHistorySize)
+        self._digests = digest.DigestBuffer()
+        self._application = gntp.records.ApplicationHeaders.get(kApplicationName)
+        self._rules = rules.RuleIndex()
+        self._subscribedToDevices = False
+        self._subscribedToVariables = False
+        self._subscribers = gntp.subscription.SubscriberRegistry(ttl=kSubscriptionTTL)
+        self._subscriptionServer = None
+        self._subscriptionSettings = None
+        self._submissionServer = None
+        self._profiler = profiling.HotPathProfiler([(self, "notify"),
+                                                    (self, "notifyMany"),
+                                                    (self, "_deliver"),
+                                                    (self, "substitute"),
+                                                    (gntp, "parse_gntp"),
+                                                    (gntp.GNTPRegister, "encode"),
+                                                    (gntp.records.NotificationRecord, "encode"),
+                                                    (NewGrowl.GrowlNotifier, "_send")])
+
+    def startup(self):
+        self._loadRules()
+        self._updateSubscriptionServer()
+        self._updateSubmissionServer()
+
+    def shutdown(self):
+        if NewGrowl.GrowlNotifier.recorder is not None:
+            self.stopCapture()
+        if self._profiler.running:
+            self.stopProfiling()
+        if self._subscriptionServer is not None:
+            self._subscriptionServer.stop()
+        if self._submissionServer is not None:
+            self._submissionServer.stop()
+        # rather than lose them
+        self._sendDigests(everything=True)
+
+    def runConcurrentThread(self):
+        try:
+            while True:
+                self._failures.report()
+                self._sendDigests()
+                self.sleep(10)
+        except self.StopThread:
+            pass
 
     ########################################
     # Get the notifications
@@ -81,21 +176,258 @@ class Plugin(indigo.PluginBase):
             errorsDict["notification7"] = "You must specify a value for this notification type"
         if valuesDict["notification8"] == "":
             errorsDict["notification8"] = "You must specify a value for this notification type"
+        if valuesDict.get("acceptSubscriptions", False):
+            try:
+                if not 0 < int(valuesDict.get("subscriptionPort", kSubscriptionPort)) < 65536:
+                    raise ValueError()
+            except ValueError:
+                errorsDict["subscriptionPort"] = "You must specify a port number between 1 and 65535"
+        try:
+            if int(valuesDict.get("errorSummaryMinutes", kErrorSummaryMinutes)) < 1:
+                raise ValueError()
+        except ValueError:
+            errorsDict["errorSummaryMinutes"] = "You must specify a whole number of minutes"
+        try:
+            if int(valuesDict.get("digestMinutes", kDigestMinutes)) < 1:
+                raise ValueError()
+        except ValueError:
+            errorsDict["digestMinutes"] = "You must specify a whole number of minutes"
+        for key, default in (("quietStart", kQuietStart), ("quietEnd", kQuietEnd)):
+            try:
+                digest.minuteOfDay(valuesDict.get(key, default))
+            except ValueError:
+                errorsDict[key] = "You must specify a time like 22:00"
         if len(errorsDict) > 0:
             return (False, valuesDict, errorsDict)
         return (True, valuesDict)
 
     def closedPrefsConfigUi(self, valuesDict, userCancelled):
         # Since they can change the notification list, we need to register those changes
-        # with Growl
+        # with Growl - but only if something Growl cares about actually changed
+        if userCancelled:
+            return
         self.debugLog(u"pluginPrefs: %s" % str(self.pluginPrefs))
-        self.notify(None)
+        self._updateSubscriptionServer()
+        self._updateSubmissionServer()
+        self._failures.window = self._errorSummaryWindow()
+        snapshot = self._notificationSnapshot()
+        if snapshot == self._registeredSnapshot:
+            self.debugLog(u"notification types unchanged, not re-registering")
+            return
+        self.debugLog(u"notification types changed from %s to %s" % (str(self._registeredSnapshot), str(snapshot)))
+        self._registeredSnapshot = snapshot
+        registerThread = threading.Thread(target=self._register, name="growl-register")
+        registerThread.daemon = True
+        registerThread.start()
+
+    def _errorSummaryWindow(self):
+        return int(self.pluginPrefs.get("errorSummaryMinutes", kErrorSummaryMinutes)) * 60
+
+    def _notificationSnapshot(self):
+        # Everything that goes into a registration: the protocol, the hosts, their passwords and the enabled
+        # notification names in order. The passwords are hashed since the snapshot is written to the debug log.
+        passwords = u"%s\0%s" % (self.pluginPrefs.get("password", ""), self.pluginPrefs.get("backupPassword", ""))
+        return (self.pluginPrefs.get("growlVersion", "auto"),
+                self.pluginPrefs.get("hostname", "localhost"),
+                self.pluginPrefs.get("backupHostname", ""),
+                hashlib.sha1(passwords.encode("utf-8")).hexdigest(),
+                tuple(self._notificationNames(self.getNotificationList())))
+
+    def _register(self):
+        # Register the current notification list with each Growl target without showing a notification.
+        # The hosts may have changed too, so their protocols are detected again.
+        listToGrowl = self._notificationNames(self.getNotificationList())
+        if len(listToGrowl) == 0:
+            return
+        with self._sendersLock:
+            self._senders = {}
+            self._undetected = {}
+            self._sendersGeneration += 1
+        roles = ["primary", "backup"] if self._hasBackupHost() else ["primary"]
+        for role in roles:
+            try:
+                self._sender(role)
+            except Exception, e:
+                self.errorLog(u"Unable to register the updated list of notifications with Growl on %s\n%s" % (self._host(role)[0], str(e)))
+
+    ########################################
+    # Growl hosts
+    ########################################
+    def _gntpNotifier(self, listToGrowl, hostname, password, port=23053):
+        return NewGrowl.GrowlNotifier(applicationName=kApplicationName, notifications=listToGrowl, applicationIcon=kIconURL,
+                                      hostname=hostname, password=password or None, port=port,
+                                      timeout=kGrowlTimeout)
+
+    def _host(self, role):
+        # (hostname, password) of the primary or backup host
+        if role == "backup":
+            return (self.pluginPrefs.get("backupHostname", "").strip(), self.pluginPrefs.get("backupPassword", ""))
+        return (self.pluginPrefs.get("hostname", "localhost").strip() or "localhost", self.pluginPrefs.get("password", ""))
+
+    def _hasBackupHost(self):
+        return self.pluginPrefs.get("backupHostname", "").strip() != ""
+
+    def _isHedged(self, typeKey):
+        return self._hasBackupHost() and typeKey in self.pluginPrefs.get("hedgedTypes", [])
+
+    def _sender(self, role):
+        # The sender for the host's protocol, registered with the current notification types. The protocol
+        # is only detected the first time - or again after _forgetSender() - unless the prefs name one.
+        # Probing and registering can take seconds, so they happen outside the lock.
+        protocol = self.pluginPrefs.get("growlVersion", "auto")
+        with self._sendersLock:
+            generation = self._sendersGeneration
+            sender = stale = self._senders.get(role)
+            if sender is not None and sender.protocol == "1.2" and protocol == "auto" \
+                    and time.time() - sender.detected > kLegacyRedetectInterval:
+                # it may have been upgraded or gone to sleep - nothing sent to it would have failed to say so
+                sender = None
+            hostname, password = self._host(role)
+            if sender is None and protocol == "auto" and time.time() - self._undetected.get(role, 0) < kRedetectInterval:
+                raise senders.SenderError(u"No Growl was found on %s - make sure the Growl application is running" % hostname)
+        if sender is None:
+            if protocol == "auto":
+                protocol = senders.detect(hostname, password)
+                with self._sendersLock:
+                    if protocol is None:
+                        self._undetected[role] = time.time()
+                    else:
+                        self._undetected.pop(role, None)
+                if protocol is None:
+                    raise senders.SenderError(u"No Growl was found on %s - make sure the Growl application is running" % hostname)
+                self.debugLog(u"%s speaks the Growl v%s protocol" % (hostname, protocol))
+            if protocol == "1.2":
+                sender = senders.LegacySender(hostname, password, kApplicationName, kIconFileName)
+            elif protocol == "1.3":
+                sender = senders.GNTPSender(hostname, password, kApplicationName, kIconURL, kGrowlTimeout)
+            else:
+                raise senders.SenderError(u"Unknown Growl version")
+            with self._sendersLock:
+                # _register() may have started over with new hosts meanwhile, and another thread may
+                # have got there first
+                if generation == self._sendersGeneration:
+                    if self._senders.get(role) in (None, stale):
+                        self._senders[role] = sender
+                    else:
+                        sender = self._senders[role]
+        snapshot = self._notificationSnapshot()
+        if sender.registered != snapshot:
+            sender.register(snapshot, self._notificationNames(self.getNotificationList()))
+        return sender
+
+    def _forgetSender(self, role, sender):
+        with self._sendersLock:
+            if self._senders.get(role) is sender:
+                del self._senders[role]
+
+    def _withSender(self, send, fallback=None):
+        # Calls send(sender) with the primary host's sender. If the host can't be reached its protocol is
+        # detected again, and if it changed (Growl was upgraded or replaced) the send is tried once more.
+        # If there's no sender for the primary host at all, fallback(sender) is called with the backup
+        # host's sender instead when it's given.
+        try:
+            sender = self._sender("primary")
+        except (socket.error, senders.SenderError), e:
+            if fallback is None:
+                raise
+            self.debugLog(u"sending to the backup host, the primary host isn't available: %s" % str(e))
+            return fallback(self._sender("backup"))
+        try:
+            return send(sender)
+        except socket.error:
+            self._forgetSender("primary", sender)
+            if self.pluginPrefs.get("growlVersion", "auto") != "auto":
+                raise
+            try:
+                retry = self._sender("primary")
+            except Exception:
+                retry = None
+            if retry is None or retry.protocol == sender.protocol:
+                raise
+            self.debugLog(u"%s now speaks the Growl v%s protocol, sending again" % (retry.hostname, retry.protocol))
+            return send(retry)
+
+    ########################################
+    # Subscriptions from other Growl clients
+    ########################################
+    def _updateSubscriptionServer(self):
+        accept = bool(self.pluginPrefs.get("acceptSubscriptions", False))
+        # the port is only checked when the prefs are saved with subscriptions on, so it may not be a number otherwise
+        settings = (accept,
+                    int(self.pluginPrefs.get("subscriptionPort", kSubscriptionPort)) if accept else None,
+                    self.pluginPrefs.get("subscriptionPassword", "") or None)
+        if settings == self._subscriptionSettings:
+            return
+        self._subscriptionSettings = settings
+        if self._subscriptionServer is not None:
+            self._subscriptionServer.stop()
+            self._subscriptionServer = None
+        accept, port, password = settings
+        if not accept:
+            return
+        try:
+            self._subscriptionServer = gntp.subscription.SubscriptionServer(self._subscribers, port=port, password=password,
+                                                                            onSubscribe=self._subscribed)
+        except socket.error, e:
+            self.errorLog(u"Unable to accept Growl subscriptions on port %d\n%s" % (port, str(e)))
+            return
+        self._subscriptionServer.start()
+        self.debugLog(u"accepting Growl subscriptions on port %d" % port)
+
+    def _subscribed(self, subscriber, new):
+        if not new:
+            return
+        indigo.server.log(u"%s (%s) subscribed to Growl notifications" % (subscriber.name, subscriber.hostname))
+        result = self._pushTo(subscriber, [])
+        if result is not True:
+            self.errorLog(u"Unable to register with subscriber %s (%s)\n%s" % (subscriber.name, subscriber.hostname, str(result)))
+
+    def _pushToSubscribers(self, notifications):
+        # Runs on its own thread so subscribers never hold up delivery to the Growl host
+        subscribers = self._subscribers.live()
+        if len(subscribers) == 0:
+            return
+        pushThread = threading.Thread(target=gntp.subscription.broadcast, name="growl-push",
+                                      args=(subscribers, lambda subscriber: self._pushTo(subscriber, notifications)))
+        pushThread.daemon = True
+        pushThread.start()
+
+    def _pushTo(self, subscriber, notifications):
+        # Registers with the subscriber if it hasn't seen the current notification types, then sends
+        snapshot = self._notificationSnapshot()
+        growl = self._gntpNotifier(self._notificationNames(self.getNotificationList()), subscriber.hostname,
+                                   self.pluginPrefs.get("subscriptionPassword", ""), subscriber.port)
+        try:
+            if subscriber.registered != snapshot:
+                result = growl.register()
+                if result is not True:
+                    return result
+                subscriber.registered = snapshot
+            for result in growl.notify_many(notifications):
+                if isinstance(result, socket.error):
+                    raise result
+                if result is not True:
+                    self.debugLog(u"push to %s failed: %s" % (subscriber.name, str(result)))
+        except socket.error, e:
+            # It's gone away - it'll be added back when it subscribes again
+            self.debugLog(u"dropping subscriber %s: %s" % (subscriber.name, str(e)))
+            self._subscribers.remove(subscriber.id)
+            return e
+        return True
 
     ########################################
     # UI Validate, Close, and Actions defined in Actions.xml:
     ########################################
     def validateActionConfigUi(self, valuesDict, typeId, devId):
         errorsDict = indigo.Dict()
+        if typeId == "showHistory":
+            try:
+                if int(valuesDict.get("count", 10)) < 1:
+                    raise ValueError()
+            except ValueError:
+                errorsDict["count"] = "You must specify how many notifications to show"
+                return (False, valuesDict, errorsDict)
+            return (True, valuesDict)
         validSubstitution = self.substitute(valuesDict['title'], validateOnly=True)
         if not validSubstitution[0]:
             errorsDict['title'] = validSubstitution[1]
@@ -114,63 +446,397 @@ class Plugin(indigo.PluginBase):
         valuesDict['description'] = descString
         return (True, valuesDict)
 
+    ########################################
+    def _notificationNames(self, notificationList):
+        listToGrowl = []
+        for key in notificationList:
+            if self.pluginPrefs[key[0]] != "":
+                listToGrowl.append(key[1])
+        return listToGrowl
+
+    def _notificationFromProps(self, props):
+        # Returns the keyword arguments for GrowlNotifier.notify() or None if
+        # the props can't be turned into a notification (the error is logged)
+        typeString = self.pluginPrefs.get(props.get("type", ""), "")
+        if typeString == "":
+            self.errorLog(u"Action is configured with a notification that has been disabled - reconfigure the action")
+            return None
+        try:
+            growlPriority = int(props.get("priority", 0))
+            growlSticky = bool(props.get("sticky", False))
+        except:
+            self.errorLog(u"Action is misconfigured")
+            return None
+        return {"noteType": typeString,
+                "title": self.substitute(props.get("title", "")),
+                "description": self.substitute(props.get("descString", "")),
+                "priority": growlPriority,
+                "sticky": growlSticky}
+
     ########################################
     def notify(self, action):
         self.debugLog(u"notify")
-        updateOnly = (action is None)
-        notificationList = self.getNotificationList()
-        if updateOnly:
-            typeString = notificationList[0][1]
-            substitutedTitle = "Indigo Plugin Update"
-            substitutedDescription = "The list of notifications for the Indigo Plugin was updated."
-            growlPriority = 0
-            growlSticky = False
-        else:
-            typeString = self.pluginPrefs[action.props["type"]]
-            substitutedTitle = self.substitute(action.props.get("title", ""))
-            substitutedDescription = self.substitute(action.props.get("descString", ""))
-            try:
-                growlPriority = int(action.props.get("priority", 0))
-                growlSticky = bool(action.props.get("sticky", False))
-            except:
-                self.errorLog(u"Action is misconfigured")
-                return
-        if typeString != "":
-            listToGrowl = []
-            for key in notificationList:
-                if self.pluginPrefs[key[0]] != "":
-                    listToGrowl.append(key[1])
-            growlVersion = self.pluginPrefs.get("growlVersion", "1.3")
-            if growlVersion == "1.2":
-                try:
-                    theIcon = OldGrowl.Image.imageFromPath(kIconFileName)
-                    growl = OldGrowl.GrowlNotifier(applicationName=kApplicationName, notifications=listToGrowl, applicationIcon=theIcon)
-                    growl.register()
-                    growl.notify(noteType=typeString,
-                                 title=substitutedTitle,
-                                 description=substitutedDescription,
-                                 priority=growlPriority,
-                                 sticky=growlSticky)
-                except Exception, e:
-                    self.errorLog(u"Unable to send Growl v1.2 Notification - make sure you have the correct version selected in the Growl plugin preferences\n%s" % str(e))
-            elif growlVersion == "1.3":
+        notification = self._notificationFromProps(action.props)
+        if notification is not None:
+            self._deliver(action.props["type"], notification)
+
+    def _deliver(self, typeKey, notification, immediate=False):
+        # Send one notification (keyword arguments for GrowlNotifier.notify) to Growl. typeKey is the
+        # pref key of the notification type. Unless immediate is set it's held for a digest if that's
+        # how its type is delivered.
+        if not immediate and self._hold(typeKey, notification):
+            return
+        self._pushToSubscribers([notification])
+        hedged = self._isHedged(typeKey)
+
+        def send(sender):
+            if hedged:
                 try:
-                    growl = NewGrowl.GrowlNotifier(applicationName=kApplicationName, notifications=listToGrowl, applicationIcon="http://static.indigodomo.com/www/images/growlicon_64x64.png")
-                    growl.register()
-                    growl.notify(noteType=typeString,
-                                 title=substitutedTitle,
-                                 description=substitutedDescription,
-                                 priority=growlPriority,
-                                 sticky=growlSticky)
-                except socket.error, e:
-                    if e.errno == 61:   # Connection refused, very likely they don't have the Growl app running.
-                        self.errorLog(u"Unable to send Growl Notification - make sure the Growl application is running.")
-                    else:
-                        self.errorLog(u"Unable to send Growl Notification - make sure you have the correct version selected in the Growl plugin preferences\n" + str(e))
+                    backup = self._sender("backup")
                 except Exception, e:
-                    self.errorLog(u"Unable to send Growl Notification - make sure you have the correct version selected in the Growl plugin preferences\n" + str(e))
+                    self.debugLog(u"not hedging, the backup host isn't available: %s" % str(e))
+                    backup = None
+                # hedging needs an answer from each host to know which won, so it's GNTP only
+                if backup is not None and sender.protocol == backup.protocol == "1.3":
+                    return senders.HedgedSender(sender, backup).notify(notification)
+            return sender.notify(notification)
+
+        # the host it went to, which is the backup when the primary host couldn't be used at all
+        target = [self._host("primary")[0]]
+
+        def sendToBackup(backup):
+            target[0] = backup.hostname
+            return backup.notify(notification)
+
+        # failures are logged once and then summarized, so an outage doesn't flood the event log
+        started = time.time()
+        try:
+            result = self._withSender(send, sendToBackup if hedged else None)
+        except Exception, e:
+            result = e
+        hostname = target[0]
+        self._history.record(typeKey, notification["priority"], hostname, "sent" if result is True else "failed",
+                             time.time() - started, notification["title"])
+        if result is True:
+            self._failures.succeeded(hostname)
+        else:
+            self._failures.failed(hostname, result)
+
+    ########################################
+    def notifyMany(self, action):
+        # Returns what happened to each notification, in order: "sent", "held" for a digest,
+        # "rejected" if its props were wrong (the error is logged), or "failed: " and why
+        self.debugLog(u"notifyMany")
+        outcomes = []
+        notifications = []
+        typeKeys = []
+        for props in action.props.get("notifications", []):
+            notification = self._notificationFromProps(props)
+            if notification is None:
+                outcomes.append("rejected")
             else:
-                self.errorLog(u"Unknown Growl version")
-            return
+                outcomes.append(None)
+                notifications.append(notification)
+                typeKeys.append(props["type"])
+        try:
+            parallelism = int(action.props.get("parallelism", kDefaultParallelism))
+        except ValueError:
+            self.errorLog(u"Action is misconfigured")
+            return ["rejected"] * len(outcomes)
+        if len(notifications) > 0:
+            delivered = iter(self._deliverMany(typeKeys, notifications, parallelism))
+            outcomes = [outcome or delivered.next() for outcome in outcomes]
+        return outcomes
+
+    def _deliverMany(self, typeKeys, notifications, parallelism):
+        # Send many notifications at once - typeKeys has the pref key of each one's notification type.
+        # Returns what happened to each one: "sent", "held" for a digest, or "failed: " and why.
+        outcomes = ["held" if self._hold(typeKey, notification) else None
+                    for typeKey, notification in zip(typeKeys, notifications)]
+        sending = [index for index, outcome in enumerate(outcomes) if outcome is None]
+        if len(sending) == 0:
+            return outcomes
+        typeKeys = [typeKeys[index] for index in sending]
+        notifications = [notifications[index] for index in sending]
+        self._pushToSubscribers(notifications)
+
+        def send(sender):
+            results = sender.notifyMany(notifications, parallelism)
+            if all(isinstance(result, socket.error) for result in results):
+                # the host is gone rather than refusing some of them
+                raise results[0]
+            return results
+
+        hostname = self._host("primary")[0]
+        started = time.time()
+        try:
+            results = self._withSender(send)
+        except Exception, e:
+            results = [e] * len(notifications)
+            self._failures.failed(hostname, e, len(notifications))
         else:
-            self.errorLog(u"Action is configured with a notification that has been disabled - reconfigure the action")
+            failed = [result for result in results if result is not True]
+            for result in failed:
+                self._failures.failed(hostname, result)
+            if len(failed) == 0:
+                self._failures.succeeded(hostname)
+        # they're sent together, so each one is recorded with the time the whole batch took
+        elapsed = time.time() - started
+        for index, notification in enumerate(notifications):
+            outcome = "sent" if results[index] is True else "failed"
+            self._history.record(typeKeys[index], notification["priority"], hostname, outcome, elapsed, notification["title"])
+            outcomes[sending[index]] = outcome if results[index] is True else u"failed: " + failures.classify(results[index])
+        return outcomes
+
+    ########################################
+    # Digests
+    ########################################
+    def _deliveryMode(self, typeKey):
+        # "immediate", "digest" or "quiet" - delivery1 goes with notification1 and so on
+        return self.pluginPrefs.get("delivery" + typeKey[len("notification"):], "immediate")
+
+    def _inQuietHours(self):
+        return digest.inQuietHours(self.pluginPrefs.get("quietStart", kQuietStart), self.pluginPrefs.get("quietEnd", kQuietEnd))
+
+    def _hold(self, typeKey, notification):
+        # Puts the notification in its type's digest if that's how the type is delivered right now.
+        # Returns True if it was held. Emergencies are never held.
+        if notification["priority"] >= 2:
+            return False
+        mode = self._deliveryMode(typeKey)
+        if mode == "immediate" or (mode == "quiet" and not self._inQuietHours()):
+            return False
+        self._digests.add(typeKey, gntp.records.NotificationRecord(self._application, notification["noteType"],
+                                                                   notification["title"], notification["description"],
+                                                                   sticky=notification["sticky"],
+                                                                   priority=notification["priority"]))
+        return True
+
+    def _sendDigests(self, everything=False):
+        # Sends each digest that's due: every few minutes for digest types, when quiet hours end for quiet
+        # types, and straight away for a type that's been switched back to immediate
+        period = int(self.pluginPrefs.get("digestMinutes", kDigestMinutes)) * 60
+        now = time.time()
+        for typeKey, since in self._digests.pending():
+            mode = self._deliveryMode(typeKey)
+            if not everything:
+                if mode == "digest" and now - since < period:
+                    continue
+                if mode == "quiet" and self._inQuietHours():
+                    continue
+            held = self._digests.take(typeKey)
+            if held is None:
+                continue
+            # the type may have been renamed since, Growl only knows the current name
+            typeString = self.pluginPrefs.get(typeKey, "")
+            if typeString == "":
+                self.errorLog(u"Dropping %d held notifications, their notification type has been disabled" % len(held.records))
+                continue
+            self._deliver(typeKey, held.combine(typeString), immediate=True)
+
+    ########################################
+    # Local submissions from scripts and other plugins
+    ########################################
+    def _updateSubmissionServer(self):
+        accept = bool(self.pluginPrefs.get("acceptLocal", True))
+        if accept == (self._submissionServer is not None):
+            return
+        if not accept:
+            self._submissionServer.stop()
+            self._submissionServer = None
+            return
+        path = self._submissionPath()
+        try:
+            self._submissionServer = submissions.SubmissionServer(path, self._submitted, self._checkSubmission, self.errorLog)
+        except (socket.error, OSError), e:
+            self.errorLog(u"Unable to accept notifications on %s\n%s" % (path, str(e)))
+            return
+        self._submissionServer.start()
+        self.debugLog(u"accepting notifications on %s" % path)
+
+    def _submissionPath(self):
+        # In the plugin's own Preferences folder so no other user can take the path first. macOS only allows
+        # 104 bytes for the path of a UNIX domain socket, too few for the whole plugin id in that folder.
+        return os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins",
+                            self.pluginId.rsplit(".", 1)[-1] + ".sock")
+
+    def _checkSubmission(self, submission):
+        # Returns why a submitted notification can't be sent, or None. The type may be given as the pref
+        # key or the name of the notification type - it's replaced by the key so it's only looked up once.
+        if not submission.get("title"):
+            return u"a notification needs a title"
+        if not isinstance(submission["title"], basestring):
+            return u"title must be a string"
+        if not isinstance(submission.get("description", u""), basestring):
+            return u"description must be a string"
+        try:
+            if not -2 <= int(submission.get("priority", 0)) <= 2:
+                raise ValueError()
+        except (TypeError, ValueError):
+            return u"priority must be a whole number from -2 to 2"
+        if submission.get("sticky", False) not in (True, False):
+            return u"sticky must be true or false"
+        typeValue = submission.get("type")
+        for typeKey, typeString in self.getNotificationList():
+            if typeValue in (typeKey, typeString):
+                submission["type"] = typeKey
+                return None
+        return u"there's no enabled notification type \"%s\"" % typeValue
+
+    def _submitted(self, batch):
+        try:
+            typeKeys = []
+            notifications = []
+            for submission in batch:
+                notification = self._notificationFromProps({"type": submission["type"],
+                                                            "title": submission["title"],
+                                                            "descString": submission.get("description", ""),
+                                                            "priority": submission.get("priority", 0),
+                                                            "sticky": submission.get("sticky", False)})
+                if notification is not None:
+                    typeKeys.append(submission["type"])
+                    notifications.append(notification)
+            if len(notifications) == 0:
+                return
+            self._deliverMany(typeKeys, notifications, kDefaultParallelism)
+        except Exception, e:
+            self.errorLog(u"Unable to send %d submitted notifications\n%s" % (len(batch), str(e)))
+
+    ########################################
+    # Notification history
+    ########################################
+    def getHistoryTypeList(self, filter="", valuesDict=None, typeId="", targetId=0):
+        return [("any", "Any type")] + self.getNotificationList()
+
+    def showHistory(self, action):
+        return self._logHistory(action.props)
+
+    def _logHistory(self, props):
+        # Logs the notifications matching the props of the Show Notification History action or menu
+        # item, newest first, and returns them
+        typeKey = props.get("historyType", "any")
+        outcome = props.get("outcome", "any")
+        period = props.get("period", "all")
+        try:
+            count = int(props.get("count", 10))
+        except ValueError:
+            self.errorLog(u"Action is misconfigured")
+            return []
+        since = None
+        if period == "hour":
+            since = time.time() - 3600
+        elif period == "today":
+            since = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+        entries = self._history.query(typeKey=None if typeKey == "any" else typeKey,
+                                      outcome=None if outcome == "any" else outcome,
+                                      since=since, limit=count)
+        description = u"notifications" if typeKey == "any" else self.pluginPrefs.get(typeKey, typeKey)
+        if outcome == "failed":
+            description = u"failed " + description
+        elif outcome == "sent":
+            description += u" sent"
+        if len(entries) == 0:
+            indigo.server.log(u"No %s in the notification history" % description)
+            return entries
+        lines = [u"Last %d %s:" % (len(entries), description)]
+        for entry in entries:
+            typeString = self.pluginPrefs.get(entry.typeKey, "")
+            lines.append(u"  %s  %-18s %-6s %5d ms  %s  %s" % (time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.time)),
+                                                             typeString, entry.outcome, round(entry.latency * 1000),
+                                                             entry.target, entry.title))
+        indigo.server.log(u"\n".join(lines))
+        return entries
+
+    ########################################
+    # Notification rules
+    ########################################
+    def _rulesPath(self):
+        return os.path.join(indigo.server.getInstallFolderPath(), "Preferences", "Plugins", self.pluginId + ".rules.json")
+
+    def _loadRules(self):
+        path = self._rulesPath()
+        if not os.path.exists(path):
+            self.debugLog(u"no notification rules file at %s" % path)
+            self._rules = rules.RuleIndex()
+            return
+        try:
+            self._rules = rules.RuleIndex.fromFile(path)
+        except (IOError, ValueError, TypeError, AttributeError, rules.RuleError), e:
+            self.errorLog(u"Unable to load notification rules from %s - keeping the previous rules\n%s" % (path, str(e)))
+            return
+        indigo.server.log(u"Loaded %d notification rules" % len(self._rules.rules))
+        # Only ask Indigo for changes we have rules for - every subscription costs the server IPC on every change
+        if self._rules.hasDeviceRules() and not self._subscribedToDevices:
+            indigo.devices.subscribeToChanges()
+            self._subscribedToDevices = True
+        if self._rules.hasVariableRules() and not self._subscribedToVariables:
+            indigo.variables.subscribeToChanges()
+            self._subscribedToVariables = True
+
+    def deviceUpdated(self, origDev, newDev):
+        indigo.PluginBase.deviceUpdated(self, origDev, newDev)
+        for rule, old, new in self._rules.deviceChanged(newDev.id, newDev.__class__.__name__, origDev.states, newDev.states):
+            self._fireRule(rule, newDev.name, old, new)
+
+    def variableUpdated(self, origVar, newVar):
+        for rule, old, new in self._rules.variableChanged(newVar.id, origVar.value, newVar.value):
+            self._fireRule(rule, newVar.name, old, new)
+
+    def _fireRule(self, rule, name, old, new):
+        typeString = self.pluginPrefs.get(rule.typeKey, "")
+        if typeString == "":
+            self.errorLog(u"Notification rule %d uses a notification that has been disabled - fix the rule" % rule.index)
+            return
+        title, description = rule.render(name, old, new)
+        self._deliver(rule.typeKey, {"noteType": typeString,
+                                     "title": self.substitute(title),
+                                     "description": self.substitute(description),
+                                     "priority": rule.priority,
+                                     "sticky": rule.sticky})
+
+    ########################################
+    # Menu items defined in MenuItems.xml:
+    ########################################
+    def reloadRules(self):
+        self._loadRules()
+
+    def showHistoryMenu(self, valuesDict, typeId):
+        self._logHistory(valuesDict)
+        return True
+
+    def startCapture(self):
+        if NewGrowl.GrowlNotifier.recorder is not None:
+            self.errorLog(u"Traffic capture is already running: %s" % NewGrowl.GrowlNotifier.recorder.path)
+            return
+        path = os.path.join(indigo.server.getLogsFolderPath(pluginId=self.pluginId),
+                            time.strftime("traffic-%Y%m%d-%H%M%S.gntpcap"))
+        NewGrowl.GrowlNotifier.recorder = gntp.capture.CaptureWriter(path)
+        indigo.server.log(u"Recording Growl traffic to %s" % path)
+
+    def stopCapture(self):
+        recorder = NewGrowl.GrowlNotifier.recorder
+        if recorder is None:
+            self.errorLog(u"Traffic capture isn't running")
+            return
+        NewGrowl.GrowlNotifier.recorder = None
+        recorder.close()
+        indigo.server.log(u"Recorded %d Growl messages to %s" % (recorder.count, recorder.path))
+
+    def startProfiling(self):
+        if self._profiler.running:
+            self.errorLog(u"Profiling is already running")
+            return
+        self._profiler.start()
+        indigo.server.log(u"Profiling Growl notifications - choose Stop Profiling from the plugin menu when done")
+
+    def stopProfiling(self):
+        if not self._profiler.running:
+            self.errorLog(u"Profiling isn't running")
+            return
+        path = os.path.join(indigo.server.getLogsFolderPath(pluginId=self.pluginId),
+                            time.strftime("profile-%Y%m%d-%H%M%S.prof"))
+        stats = self._profiler.stop(path)
+        if stats is None:
+            indigo.server.log(u"Profiling stopped - no notifications were sent while it was running")
+            return
+        indigo.server.log(u"Profile written to %s\n%s" % (path, profiling.summarize(stats)))
@@ -0,0 +1,115 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# On-demand profiling of the notification hot path.
+#
+# While a session is running the functions being profiled are replaced by
+# wrappers that run them under cProfile. When the session stops the original
+# functions are put back, so there's no cost at all while profiling is off.
+#
+# Each thread gets its own profiler because cProfile can't be shared between
+# threads, and notifications are sent from several (notifyMany, hedging).
+# The profiles are merged when the session stops.
+
+import cProfile
+import functools
+import pstats
+import threading
+
+_missing = object()
+
+################################################################################
+class _ThreadProfile(object):
+    # One thread's profiler - kept outside the threading.local so stop() can see it from another thread
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.active = False
+
+################################################################################
+class HotPathProfiler(object):
+    ########################################
+    def __init__(self, targets):
+        # targets is a list of (owner, attribute name) - owner can be a module, class or instance
+        self.targets = targets
+        self.running = False
+        self._saved = []
+        self._profiles = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    ########################################
+    def start(self):
+        if self.running:
+            return
+        self._profiles = []
+        self._local = threading.local()
+        for owner, name in self.targets:
+            self._saved.append((owner, name, owner.__dict__.get(name, _missing)))
+            setattr(owner, name, self._wrap(getattr(owner, name)))
+        self.running = True
+
+    def stop(self, path):
+        # Puts the original functions back and writes the merged profile to path.
+        # Returns the pstats.Stats or None if nothing was profiled.
+        if not self.running:
+            return None
+        for owner, name, original in reversed(self._saved):
+            if original is _missing:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._saved = []
+        self.running = False
+        with self._lock:
+            # a call that's still running on another thread is left out
+            profiles = [state.profile for state in self._profiles if not state.active]
+            self._profiles = []
+        stats = None
+        for profile in profiles:
+            try:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            except TypeError:
+                # this thread's profiler never ran a call
+                continue
+        if stats is not None:
+            stats.dump_stats(path)
+        return stats
+
+    ########################################
+    def _wrap(self, function):
+        profiler = self
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            state = getattr(profiler._local, "state", None)
+            if state is None:
+                state = profiler._local.state = _ThreadProfile()
+                with profiler._lock:
+                    profiler._profiles.append(state)
+            elif state.active:
+                # an outer profiled call on this thread is already capturing this one
+                return function(*args, **kwargs)
+            state.active = True
+            try:
+                return state.profile.runcall(function, *args, **kwargs)
+            finally:
+                state.active = False
+        return wrapper
+
+################################################################################
+def summarize(stats, count=10):
+    # Short top-N summary by cumulative time, one line per function
+    entries = []
+    for (filename, line, function), (primitive, calls, own, cumulative, callers) in stats.stats.iteritems():
+        if filename == HotPathProfiler._wrap.__func__.__code__.co_filename:
+            # our own wrappers
+            continue
+        entries.append((cumulative, own, calls, u"%s:%d(%s)" % (filename.split("/")[-1], line, function)))
+    entries.sort(reverse=True)
+    lines = [u"%d calls in %.3fs" % (stats.total_calls, stats.total_tt)]
+    for cumulative, own, calls, where in entries[:count]:
+        lines.append(u"  %8.4fs cumulative  %8.4fs own  %6d calls  %s" % (cumulative, own, calls, where))
+    return u"\n".join(lines)
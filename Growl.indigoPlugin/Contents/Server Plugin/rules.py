@@ -0,0 +1,163 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Notification rules - send a Growl notification straight from a device or
+# variable change without an Indigo trigger and action for each one.
+#
+# Rules are a JSON list of objects like these:
+#
+#   {"device": 12345, "state": "onOffState", "when": "becomes", "value": true,
+#    "type": "notification4", "title": "Motion", "description": "{name} saw motion"}
+#   {"deviceClass": "SensorDevice", "state": "batteryLevel", "when": "crossesBelow", "value": 20,
+#    "type": "notification1", "title": "Low Battery", "description": "{name} is at {new}%", "priority": 1}
+#   {"variable": 67890, "when": "changes",
+#    "type": "notification7", "title": "{name}", "description": "{old} -> {new}"}
+#
+# "when" is one of "changes", "becomes", "crossesAbove" or "crossesBelow". The title
+# and description may use {name}, {state}, {old} and {new} as well as the usual
+# %%v:VARIABLEID%% and %%d:DEVICEID:STATEKEY%% substitutions.
+#
+# Rules are indexed by device id, device class, variable id and state key so a
+# change only looks at the rules that could possibly match it.
+
+import json
+
+kConditions = ("changes", "becomes", "crossesAbove", "crossesBelow")
+
+################################################################################
+class RuleError(Exception):
+    pass
+
+################################################################################
+class Rule(object):
+    ########################################
+    def __init__(self, definition, index):
+        self.index = index
+        self.deviceId = definition.get("device")
+        self.deviceClass = definition.get("deviceClass")
+        self.variableId = definition.get("variable")
+        self.state = definition.get("state")
+        self.when = definition.get("when", "changes")
+        self.value = definition.get("value")
+        self.typeKey = definition.get("type", "")
+        self.title = definition.get("title", "")
+        self.description = definition.get("description", "")
+        self.priority = int(definition.get("priority", 0))
+        self.sticky = bool(definition.get("sticky", False))
+
+        targets = len([x for x in (self.deviceId, self.deviceClass, self.variableId) if x is not None])
+        if targets != 1:
+            raise RuleError(u"rule %d must have exactly one of device, deviceClass or variable" % index)
+        if self.variableId is None and not self.state:
+            raise RuleError(u"rule %d needs the state to watch" % index)
+        if self.when not in kConditions:
+            raise RuleError(u"rule %d has an unknown condition \"%s\"" % (index, self.when))
+        if self.when != "changes" and self.value is None:
+            raise RuleError(u"rule %d needs a value for \"%s\"" % (index, self.when))
+        if not self.typeKey.startswith("notification"):
+            raise RuleError(u"rule %d needs a notification type (notification1 - notification8)" % index)
+        if self.when in ("crossesAbove", "crossesBelow"):
+            self.value = float(self.value)
+
+    ########################################
+    def matches(self, old, new):
+        # Only called when the value changed
+        if self.when == "changes":
+            return True
+        if self.when == "becomes":
+            return _same(new, self.value) and not _same(old, self.value)
+        try:
+            old = float(old)
+            new = float(new)
+        except (TypeError, ValueError):
+            return False
+        if self.when == "crossesAbove":
+            return old <= self.value < new
+        return old >= self.value > new
+
+    ########################################
+    def render(self, name, old, new):
+        # Title and description with the rule's {placeholders} filled in
+        fields = {"name": name, "state": self.state or "value", "old": old, "new": new}
+        return (_format(self.title, fields), _format(self.description, fields))
+
+################################################################################
+class RuleIndex(object):
+    ########################################
+    def __init__(self, definitions=()):
+        self.rules = []
+        # device id -> state key -> rules
+        self.byDevice = {}
+        # device class name -> state key -> rules
+        self.byClass = {}
+        # variable id -> rules
+        self.byVariable = {}
+        for index, definition in enumerate(definitions, 1):
+            rule = Rule(definition, index)
+            self.rules.append(rule)
+            if rule.deviceId is not None:
+                self.byDevice.setdefault(int(rule.deviceId), {}).setdefault(rule.state, []).append(rule)
+            elif rule.deviceClass is not None:
+                self.byClass.setdefault(rule.deviceClass, {}).setdefault(rule.state, []).append(rule)
+            else:
+                self.byVariable.setdefault(int(rule.variableId), []).append(rule)
+
+    @classmethod
+    def fromFile(cls, path):
+        with open(path) as f:
+            definitions = json.load(f)
+        if not isinstance(definitions, list):
+            raise RuleError(u"%s must contain a list of rules" % path)
+        return cls(definitions)
+
+    ########################################
+    def hasDeviceRules(self):
+        return len(self.byDevice) > 0 or len(self.byClass) > 0
+
+    def hasVariableRules(self):
+        return len(self.byVariable) > 0
+
+    ########################################
+    def deviceChanged(self, deviceId, deviceClass, oldStates, newStates):
+        # Yields (rule, old, new) for every rule the change fires
+        for rulesByState in (self.byDevice.get(deviceId), self.byClass.get(deviceClass)):
+            if not rulesByState:
+                continue
+            for state, rules in rulesByState.iteritems():
+                old = oldStates.get(state)
+                new = newStates.get(state)
+                if old == new:
+                    continue
+                for rule in rules:
+                    if rule.matches(old, new):
+                        yield (rule, old, new)
+
+    def variableChanged(self, variableId, old, new):
+        if old == new:
+            return
+        for rule in self.byVariable.get(variableId, ()):
+            if rule.matches(old, new):
+                yield (rule, old, new)
+
+################################################################################
+def _same(actual, expected):
+    # Rule values come from JSON, states from Indigo - compare them loosely
+    if isinstance(actual, bool) or isinstance(expected, bool):
+        return _truthy(actual) == _truthy(expected)
+    if isinstance(actual, (int, long, float)) or isinstance(expected, (int, long, float)):
+        try:
+            return float(actual) == float(expected)
+        except (TypeError, ValueError):
+            return False
+    return unicode(actual) == unicode(expected)
+
+def _truthy(value):
+    if isinstance(value, basestring):
+        return value.strip().lower() in ("true", "on", "yes", "1")
+    return bool(value)
+
+def _format(template, fields):
+    try:
+        return template.format(**fields)
+    except (KeyError, IndexError, ValueError):
+        return template
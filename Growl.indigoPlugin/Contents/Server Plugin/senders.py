@@ -0,0 +1,164 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Protocol specific senders, and detection of which protocol a Growl host speaks.
+#
+# Growl 1.3 and newer speak GNTP over TCP port 23053. Growl 1.2 uses its own
+# UDP protocol on port 9887 over the network and a native API on the local Mac.
+# A host is probed once and the sender for its protocol is kept and reused;
+# the plugin only probes again when a send fails, or every so often for a
+# Growl 1.2 host since nothing it sends to one can fail.
+
+import errno
+import socket
+import subprocess
+import time
+
+import Growl.Growl as OldGrowl
+import gntp.notifier as NewGrowl
+
+kGNTPPort = 23053
+# how long to wait for each probe
+kProbeTimeout = 2.0
+
+kLocalHosts = ("", "localhost", "127.0.0.1", "::1")
+# the process that shows Growl 1.2's notifications - Growl 1.3 and newer is just "Growl"
+kLegacyProcessName = "GrowlHelperApp"
+
+################################################################################
+class SenderError(Exception):
+    pass
+
+################################################################################
+def detect(hostname, password=None):
+    # Returns the protocol the host speaks, "1.3" for GNTP or "1.2" for the legacy
+    # protocol, or None if there's no sign of Growl there at all. A host that doesn't
+    # answer anything (asleep, switched off or behind a firewall) is None too.
+    try:
+        probe = socket.create_connection((hostname, kGNTPPort), kProbeTimeout)
+        probe.close()
+        return "1.3"
+    except socket.error, e:
+        if hostname.lower() in kLocalHosts:
+            # Growl 1.2 on this Mac is reached through its native API, which never fails, so
+            # it's only used when Growl 1.2 can be seen running
+            return "1.2" if _legacyRunning() else None
+        if e.errno != errno.ECONNREFUSED:
+            # no answer at all, so nothing can be said about the host
+            return None
+    # The host refused the GNTP port, so it's up. UDP has no handshake - send an empty datagram,
+    # which Growl 1.2 ignores, and see whether the host says the port is closed.
+    try:
+        family, type, proto, canonname, address = socket.getaddrinfo(hostname, OldGrowl.GROWL_UDP_PORT, 0, socket.SOCK_DGRAM)[0]
+    except socket.error:
+        return None
+    probe = socket.socket(family, socket.SOCK_DGRAM)
+    try:
+        probe.settimeout(kProbeTimeout)
+        probe.connect(address)
+        probe.send("")
+        probe.recv(1)
+    except socket.timeout:
+        # nothing came back from a host that's up, which is what a Growl 1.2 host does
+        return "1.2"
+    except socket.error:
+        # refused (an ICMP port unreachable came back)
+        return None
+    finally:
+        probe.close()
+    return "1.2"
+
+def _legacyRunning():
+    # True if Growl 1.2 is running on this Mac
+    try:
+        processes = subprocess.Popen(["/bin/ps", "-axco", "command"], stdout=subprocess.PIPE).communicate()[0]
+    except OSError:
+        return False
+    return kLegacyProcessName in processes.splitlines()
+
+################################################################################
+class GNTPSender(object):
+    protocol = "1.3"
+
+    ########################################
+    def __init__(self, hostname, password, applicationName, iconURL, timeout):
+        self.hostname = hostname
+        self.password = password
+        self.applicationName = applicationName
+        self.iconURL = iconURL
+        self.timeout = timeout
+        self.growl = None
+        # the snapshot of notification types this host was last registered with
+        self.registered = None
+
+    def register(self, snapshot, names):
+        growl = NewGrowl.GrowlNotifier(applicationName=self.applicationName, notifications=names, applicationIcon=self.iconURL,
+                                       hostname=self.hostname, password=self.password or None, timeout=self.timeout)
+        result = growl.register()
+        if result is not True:
+            raise SenderError(u"Growl on %s rejected the registration\n%s" % (self.hostname, str(result)))
+        self.growl = growl
+        self.registered = snapshot
+
+    def notify(self, notification):
+        return self.growl.notify(**notification)
+
+    def notifyMany(self, notifications, parallelism):
+        return self.growl.notify_many(notifications, parallelism=parallelism)
+
+################################################################################
+class LegacySender(object):
+    protocol = "1.2"
+
+    ########################################
+    def __init__(self, hostname, password, applicationName, iconFileName):
+        self.hostname = hostname
+        self.password = password
+        self.applicationName = applicationName
+        self.iconFileName = iconFileName
+        self.growl = None
+        self.registered = None
+        # sends to a Growl 1.2 host never fail, so the plugin checks what it speaks again after a while
+        self.detected = time.time()
+
+    def register(self, snapshot, names):
+        if self.hostname.lower() in kLocalHosts:
+            theIcon = OldGrowl.Image.imageFromPath(self.iconFileName)
+            growl = OldGrowl.GrowlNotifier(applicationName=self.applicationName, notifications=names, applicationIcon=theIcon)
+        else:
+            # the network protocol wants the default notifications as indexes, not names
+            growl = OldGrowl.GrowlNotifier(applicationName=self.applicationName, notifications=names,
+                                           defaultNotifications=range(len(names)),
+                                           hostname=self.hostname, password=self.password or "")
+        growl.register()
+        self.growl = growl
+        self.registered = snapshot
+
+    def notify(self, notification):
+        # Growl 1.2 doesn't answer, so anything that didn't raise was sent
+        self.growl.notify(**notification)
+        return True
+
+    def notifyMany(self, notifications, parallelism):
+        # nothing to wait for, so there's nothing to gain from sending concurrently
+        results = []
+        for notification in notifications:
+            try:
+                results.append(self.notify(notification))
+            except Exception, e:
+                results.append(e)
+        return results
+
+################################################################################
+class HedgedSender(object):
+    # Sends through the primary GNTPSender and hedges to the backup when it's slow
+    protocol = "1.3"
+
+    ########################################
+    def __init__(self, primary, backup):
+        self.primary = primary
+        self.backup = backup
+        self.hostname = primary.hostname
+
+    def notify(self, notification):
+        return NewGrowl.HedgedNotifier(self.primary.growl, self.backup.growl).notify(**notification)
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+####################
+# Local submission of notifications over a UNIX domain socket.
+#
+# Scripts and other plugins on this Mac can connect to the socket and write
+# notifications as newline delimited JSON - one object per line, or a list of
+# objects on one line to send many at once:
+#
+#   {"type": "notification5", "title": "Front Door", "description": "Opened"}
+#   [{"type": "Security Events", "title": "Back Door", "priority": 1}, ...]
+#
+# Every line is answered with a line of JSON, {"accepted": N} or {"error": "..."}.
+#
+# One thread serves every connection with select(). Accepted notifications are
+# queued for a second thread that hands them to the plugin in batches. When the
+# queue is full the server stops reading, so producers that write faster than
+# Growl can take notifications block in their own writes until it catches up.
+# A line with more notifications than there's room for is queued a part at a
+# time, and only answered once all of it is queued.
+
+import errno
+import json
+import os
+import Queue
+import select
+import socket
+import threading
+
+# notifications queued before the server stops reading from producers
+kMaxPending = 1000
+# most notifications handed to the plugin at once
+kBatchSize = 100
+# a producer's unanswered replies before the server stops reading from it
+kMaxReplyBuffer = 65536
+# longest line accepted, so a producer that never sends a newline can't use up memory
+kMaxLineLength = 1024 * 1024
+
+################################################################################
+class _Connection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.received = ""
+        # received holds a complete line that hasn't been handled yet, or unqueued is not empty
+        self.waiting = False
+        self.replies = ""
+        # notifications of the line being handled that there wasn't room for yet, and how many it had
+        self.unqueued = []
+        self.accepted = 0
+
+################################################################################
+class SubmissionServer(object):
+    ########################################
+    def __init__(self, path, submit, check=None, error=None):
+        # submit is called with a list of notification dicts from a background thread. check is
+        # called with each one as it arrives and returns why it can't be sent, or None if it can.
+        # error is called with a message when submit raises - the batch is dropped either way.
+        self.path = path
+        self.submit = submit
+        self.check = check
+        self.error = error
+        self.running = False
+        self._queue = Queue.Queue()
+        # socket -> _Connection
+        self._connections = {}
+        if os.path.exists(path):
+            # left over from a plugin that didn't shut down cleanly
+            os.unlink(path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(path)
+        # only this user's scripts and plugins may submit
+        os.chmod(path, 0600)
+        self._listener.listen(16)
+        self._listener.setblocking(False)
+
+    def start(self):
+        self.running = True
+        for target, name in ((self._serve, "growl-submissions"), (self._deliver, "growl-submissions-delivery")):
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        # wakes the delivery thread
+        self._queue.put(None)
+
+    ########################################
+    def _serve(self):
+        try:
+            while self.running:
+                for connection in [connection for connection in self._connections.itervalues() if connection.waiting]:
+                    self._handle(connection)
+                readable = [self._listener]
+                if self._queue.qsize() < kMaxPending:
+                    readable.extend(connection.sock for connection in self._connections.itervalues()
+                                    if not connection.waiting and len(connection.replies) < kMaxReplyBuffer)
+                writable = [connection.sock for connection in self._connections.itervalues() if connection.replies]
+                # the timeout is how quickly reading resumes once the queue drains, and how quickly stop() is noticed
+                readable, writable, broken = select.select(readable, writable, [], 0.1)
+                for sock in readable:
+                    if sock is self._listener:
+                        self._accept()
+                    else:
+                        self._read(self._connections[sock])
+                for sock in writable:
+                    connection = self._connections.get(sock)
+                    if connection is not None:
+                        self._write(connection)
+        finally:
+            for connection in self._connections.values():
+                connection.sock.close()
+            self._connections = {}
+            self._listener.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        self._connections[sock] = _Connection(sock)
+
+    def _close(self, connection):
+        del self._connections[connection.sock]
+        connection.sock.close()
+
+    def _read(self, connection):
+        try:
+            data = connection.sock.recv(65536)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            data = ""
+        if not data:
+            # the producer is done - anything after its last newline is dropped
+            self._close(connection)
+            return
+        connection.received += data
+        self._handle(connection)
+
+    def _handle(self, connection):
+        # Handles the complete lines received so far while there's room in the queue
+        received = connection.received
+        start = 0
+        while self._queue.qsize() < kMaxPending:
+            if connection.unqueued:
+                self._enqueue(connection)
+                continue
+            end = received.find("\n", start)
+            if end < 0:
+                break
+            line = received[start:end]
+            start = end + 1
+            if line.strip():
+                result = self._accept_line(line)
+                if isinstance(result, dict):
+                    connection.replies += _reply(result)
+                else:
+                    connection.unqueued = result
+                    connection.accepted = len(result)
+        connection.received = received[start:]
+        connection.waiting = bool(connection.unqueued) or "\n" in connection.received
+        if not connection.waiting and len(connection.received) > kMaxLineLength:
+            connection.received = ""
+            connection.replies += _reply({"error": "line too long"})
+        self._write(connection)
+
+    def _accept_line(self, line):
+        # Returns the line's notifications, or the reply if it can't be accepted
+        try:
+            notifications = json.loads(line)
+        except ValueError, e:
+            return {"error": "invalid JSON: %s" % e}
+        if isinstance(notifications, dict):
+            notifications = [notifications]
+        if not isinstance(notifications, list) or not all(isinstance(notification, dict) for notification in notifications):
+            return {"error": "expected a notification object or a list of them"}
+        if self.check is not None:
+            for index, notification in enumerate(notifications):
+                problem = self.check(notification)
+                if problem is not None:
+                    # none of the line is sent, so the producer can fix it and send it again
+                    return {"error": problem, "index": index}
+        if len(notifications) == 0:
+            return {"accepted": 0}
+        return notifications
+
+    def _enqueue(self, connection):
+        # Queues as much of the line being handled as there's room for, and answers it once it's all queued
+        room = kMaxPending - self._queue.qsize()
+        for notification in connection.unqueued[:room]:
+            self._queue.put(notification)
+        connection.unqueued = connection.unqueued[room:]
+        if not connection.unqueued:
+            connection.replies += _reply({"accepted": connection.accepted})
+
+    def _write(self, connection):
+        try:
+            sent = connection.sock.send(connection.replies)
+        except socket.error, e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return
+            self._close(connection)
+            return
+        connection.replies = connection.replies[sent:]
+
+    ########################################
+    def _deliver(self):
+        while True:
+            notification = self._queue.get()
+            if notification is None:
+                return
+            batch = [notification]
+            while len(batch) < kBatchSize:
+                try:
+                    notification = self._queue.get_nowait()
+                except Queue.Empty:
+                    break
+                if notification is None:
+                    self._submit(batch)
+                    return
+                batch.append(notification)
+            self._submit(batch)
+
+    def _submit(self, batch):
+        # a batch that can't be sent mustn't stop the ones after it
+        try:
+            self.submit(batch)
+        except Exception, e:
+            if self.error is not None:
+                self.error(u"Unable to send %d submitted notifications\n%s" % (len(batch), str(e)))
+
+################################################################################
+def _reply(message):
+    return json.dumps(message) + "\n"